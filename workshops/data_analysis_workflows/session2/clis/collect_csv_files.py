@@ -4,13 +4,98 @@ import glob
 from tqdm import tqdm
 import pathlib
 import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_in_order(paths, workers):
+    """Reads the CSV files with a pool of worker threads, yielding them in the order of paths while only a few are held in memory at once."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(pd.read_csv, path))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_batches(paths, workers, dtype=None, max_rows=2 ** 16, max_bytes=2 ** 23):
+    """
+    Reads the CSV files (see read_in_order) and joins them into batches of up to max_rows rows or max_bytes bytes of CSV,
+    so that the output is written in a few large pieces (and Parquet row groups) instead of one per trial, each of
+    which holds a single row.  If dtype is given, every batch is cast to it.  Raises a ValueError if a file's columns
+    differ from the first file's.
+    """
+    columns = list(pd.read_csv(paths[0], nrows=0).columns)
+    batch, n_rows, n_bytes = [], 0, 0
+    for path, df in zip(paths, tqdm(read_in_order(paths, workers), total=len(paths))):
+        if list(df.columns) != columns:
+            raise ValueError(f"{path} has columns {list(df.columns)}, but {paths[0]} has columns {columns}")
+        batch.append(df)
+        n_rows += len(df)
+        n_bytes += os.path.getsize(path)
+        if n_rows >= max_rows or n_bytes >= max_bytes:
+            yield pd.concat(batch).astype(dtype) if dtype else pd.concat(batch)
+            batch, n_rows, n_bytes = [], 0, 0
+    if batch:
+        yield pd.concat(batch).astype(dtype) if dtype else pd.concat(batch)
+
+
+class CsvWriter:
+    """Appends DataFrames to a CSV file, which stays open between them, writing the header only once."""
+
+    def __init__(self, output_path):
+        self.file = open(output_path, 'w', newline='')
+        self.first = True
+
+    def write(self, df):
+        df.to_csv(self.file, header=self.first)
+        self.first = False
+
+    def close(self):
+        self.file.close()
+
+
+def parquet_dtypes(path):
+    """
+    Returns the dtypes to cast every batch of CSV files to for Parquet output, whose row groups all need the same schema:
+    numbers as float64 (so integers in one file and decimals or missing values in another still fit), booleans as
+    nullable booleans and everything else as strings.
+    """
+    kinds = {'i': 'float64', 'u': 'float64', 'f': 'float64', 'b': 'boolean'}
+    return {column: kinds.get(dtype.kind, 'str') for column, dtype in pd.read_csv(path).dtypes.items()}
+
+
+class ParquetWriter:
+    """Appends DataFrames, cast to the same dtypes (see parquet_dtypes), to a Parquet file, one row group each."""
+
+    def __init__(self, output_path):
+        import pyarrow  # Only needed for Parquet output
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.output_path = output_path
+        self.writer = None
+
+    def write(self, df):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pa.parquet.ParquetWriter(self.output_path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema), row_group_size=len(table))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
 
 # Create a parser object
 parser = argparse.ArgumentParser(description='Collect CSV files')
 
 # Add an argument
 parser.add_argument('input_path', type=str, help='Path to where single CSV files are located')
-parser.add_argument('output_path', type=str, help='Path where to save the final CSV file in')
+parser.add_argument('output_path', type=str, help='Path where to save the final CSV file in (or a Parquet file, if it ends in .parquet)')
+parser.add_argument('--workers', type=int, default=1, help='Number of CSV files to parse in parallel (default: 1)')
 
 # Parse the arguments
 args = parser.parse_args()
@@ -18,19 +103,23 @@ args = parser.parse_args()
 path_to_data = args.input_path
 output_path = args.output_path
 
-# Collect all the csv files
-all_paths = glob.glob(path_to_data + "*.csv")
-dfs = []
-for path in tqdm(all_paths):
-    df_per_trial = pd.read_csv(path)
-    dfs.append(df_per_trial)
-
-beh_df = pd.concat(dfs)
-
-# Add the metadata
+# Read the metadata
 metadata_path = pathlib.Path(path_to_data).with_name("metadata.json")
 metadata = json.loads(metadata_path.read_text())
 
-beh_df["session_date"] = metadata["session_date"]
+# Collect all the csv files, appending them to the output in batches as they are read,
+# so that only a batch of trials is in memory at any time
+all_paths = sorted(glob.glob(path_to_data + "*.csv"))
+if not all_paths:
+    raise FileNotFoundError(f"No CSV files found in {path_to_data}")
+
+if output_path.endswith('.parquet'):
+    writer, dtype = ParquetWriter(output_path), parquet_dtypes(all_paths[0])
+else:
+    writer, dtype = CsvWriter(output_path), None
+for df_batch in read_batches(all_paths, args.workers, dtype):
+    # Add the metadata
+    df_batch["session_date"] = metadata["session_date"]
 
-beh_df.to_csv(output_path)
\ No newline at end of file
+    writer.write(df_batch)
+writer.close()
\ No newline at end of file
@@ -1,14 +1,10 @@
 import sys
-import numpy as np
+from array_transforms import normalize_file
 
 # Command-line inputs
 input_array_path = sys.argv[1]
 output_array_path = sys.argv[2]
+axis = int(sys.argv[3]) if len(sys.argv) > 3 else None  # optional: normalize along this axis only
 
-# Load the input and normalize it
-input_array = np.load(input_array_path)
-output_array = input_array - np.min(input_array)
-output_array = output_array / np.max(output_array)
-
-# Save the normalized array
-np.save(output_array_path, output_array)
\ No newline at end of file
+# Normalize the input chunk by chunk (without loading it into memory) and save the normalized array
+normalize_file(input_array_path, output_array_path, axis=axis)
\ No newline at end of file
@@ -1,13 +1,10 @@
 import sys
-import numpy as np
+from array_transforms import standardize_file
 
 # Command-line inputs
 input_array_path = sys.argv[1] # grab the first input
 output_array_path = sys.argv[2] # grab the second input
+axis = int(sys.argv[3]) if len(sys.argv) > 3 else None # optional: standardize along this axis only
 
-# Load the input and standardize it
-input_array = np.load(input_array_path)
-output_array = (input_array - np.mean(input_array)) / np.std(input_array)
-
-# Save the standardized array
-np.save(output_array_path, output_array)
\ No newline at end of file
+# Standardize the input chunk by chunk (without loading it into memory) and save the standardized array
+standardize_file(input_array_path, output_array_path, axis=axis)
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Compares the memory allocated and time taken by the original normalize() and the new one, on a (trial, time) array."""
+import sys
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+from transformations import normalize
+
+
+def normalize_original(data, min_val=0, max_val=1):
+    data_nomred = data - data.min()
+    data_normed = data_nomred / data_nomred.max()
+    data_normed = data_normed * (max_val - min_val) + min_val
+    return data_normed
+
+
+def measure(func, data):
+    """Returns the peak memory allocated while running func(data) (in MB), and its run time (in s)."""
+    tracemalloc.start()
+    start = perf_counter()
+    func(data)
+    duration = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6, duration
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    data64 = rng.normal(size=(2000, 10000))
+    data32 = data64.astype(np.float32)
+    print(f"Input: {data64.shape} array, {data64.nbytes / 1e6:.0f} MB as float64")
+
+    cases = {
+        "original, float64": (normalize_original, data64),
+        "original, float32": (normalize_original, data32),
+        "new, float64": (normalize, data64),
+        "new, float32": (normalize, data32),
+        "new, float32, per trial (axis=1)": (lambda data: normalize(data, axis=1), data32),
+        "new, float64, in place": (lambda data: normalize(data, inplace=True), data64.copy()),
+        "new, float32, in place": (lambda data: normalize(data, inplace=True), data32.copy()),
+    }
+    for name, (func, data) in cases.items():
+        peak_mb, duration = measure(func, data)
+        print(f"{name:35s} peak allocated: {peak_mb:7.1f} MB   time: {duration * 1000:6.1f} ms")
+
+    # The steps run in the original order, so the results match exactly (and the top value is exactly max_val)
+    for data in [data64, data32, np.arange(50.)]:
+        assert np.array_equal(normalize(data), normalize_original(data))
+        assert np.array_equal(normalize(data, -1, 1), normalize_original(data, -1, 1))
+        assert normalize(data).max() == 1 and normalize(data.copy(), inplace=True).max() == 1
+    for seed in range(1000):
+        assert normalize(np.random.default_rng(seed).normal(size=100)).max() == 1
+
+    expected = normalize_original(data64, -1, 1)
+    assert np.allclose(normalize(data64, -1, 1), expected)
+    assert np.allclose(normalize(data32, -1, 1), expected, atol=1e-6)
+    per_trial = normalize(data64, axis=1)
+    assert np.allclose(per_trial.min(axis=1), 0) and np.allclose(per_trial.max(axis=1), 1)
\ No newline at end of file
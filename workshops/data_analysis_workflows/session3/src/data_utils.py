@@ -1,30 +1,132 @@
-import glob
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from tqdm import tqdm
 from scipy.io import loadmat
 from pathlib import Path
 
-def merge_behavioral_data_npy(input_data_folder):
-    
+def natural_sort_key(path):
+    """Sorts file names by the numbers in them, so that e.g. trial2.npy comes before trial10.npy."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', Path(path).name)]
+
+def find_trial_files(input_data_folder, suffix):
+    return sorted(Path(input_data_folder).glob("*" + suffix), key=natural_sort_key)
+
+def cache_filename(input_data_folder):
+    """The consolidated cache of a folder of trial files sits next to it, e.g. licks/ -> licks.merged.npz."""
+    folder = Path(input_data_folder)
+    return folder.parent / f"{folder.name}.merged.npz"
+
+def source_index(trial_files):
+    return [[filename.name, filename.stat().st_mtime_ns, filename.stat().st_size] for filename in trial_files]
+
+def read_cache(input_data_folder, index):
+    """Returns the folder's cached arrays by variable name, or an empty dict if there is no cache or its trial files have changed since."""
+    filename = cache_filename(input_data_folder)
+    if not filename.exists():
+        return {}
+    with np.load(filename) as cache:
+        if json.loads(str(cache["__index__"])) != index:
+            return {}
+        return {name: cache[name] for name in cache.files if name != "__index__"}
+
+def write_cache(input_data_folder, index, merged):
+    """Packs the merged arrays, along with the names, mtimes and sizes of the trial files they were read from, into one compressed .npz file."""
+    filename = cache_filename(input_data_folder)
+    tmp_filename = filename.with_name(filename.name + ".tmp")
+    try:
+        with open(tmp_filename, "wb") as f:
+            np.savez_compressed(f, __index__=json.dumps(index), **merged)
+        tmp_filename.replace(filename)
+    except OSError:  # e.g. a read-only data folder; merging still works, just without the cache
+        tmp_filename.unlink(missing_ok=True)
+
+def fill_trials(trial_files, load_trial, merged, workers=8, desc=None):
+    """
+    Calls load_trial(filename) for every trial file across a pool of worker threads, and writes each variable
+    of the returned dict into row idx of the matching preallocated array in merged.
+    """
+    def fill(idx, filename):
+        for name, data_per_trial in load_trial(filename).items():
+            if data_per_trial.shape != merged[name].shape[1:]:
+                raise ValueError(f"{name} in {filename} has shape {data_per_trial.shape}, but other trials have shape {merged[name].shape[1:]}")
+            merged[name][idx] = data_per_trial
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fill, idx, filename) for idx, filename in enumerate(trial_files)]
+        for future in tqdm(futures, desc=desc):
+            future.result()
+
+def merge_behavioral_data_npy(input_data_folder, out_filename=None, workers=8, use_cache=True):
+    """
+    Stacks the per-trial .npy files of a folder (in natural sort order) into one array of shape (n_trials, ...).
+    The output is allocated once and filled trial by trial by `workers` threads; if out_filename is given,
+    it is a memory-mapped .npy file on disk instead of an array in memory.
+    With use_cache, the merged array is read from (or saved to) the folder's consolidated cache (see cache_filename()),
+    which is rebuilt whenever a trial file is added, removed or modified.
+    """
     data_label = Path(input_data_folder).name
-    all_npy_files = glob.glob(input_data_folder + "*.npy")
+    all_npy_files = find_trial_files(input_data_folder, ".npy")
+    if not all_npy_files:
+        raise FileNotFoundError(f"No .npy files found in {input_data_folder}")
+
+    use_cache = use_cache and out_filename is None
+    if use_cache:
+        index = source_index(all_npy_files)
+        cached = read_cache(input_data_folder, index)
+        if data_label in cached:
+            return cached[data_label]
 
-    npy_data = []
-    for filename in tqdm(all_npy_files, desc=f"Merging the {data_label} data"):
-        npy_data_per_trial = np.load(filename)
-        npy_data.append(npy_data_per_trial)
+    first_trial = np.load(all_npy_files[0], mmap_mode="r")
+    shape = (len(all_npy_files), *first_trial.shape)
+    if out_filename is None:
+        npy_data = np.empty(shape, dtype=first_trial.dtype)
+    else:
+        npy_data = np.lib.format.open_memmap(out_filename, mode="w+", dtype=first_trial.dtype, shape=shape)
 
-    npy_data = np.stack(npy_data)
+    load_trial = lambda filename: {data_label: np.load(filename, mmap_mode="r")}
+    fill_trials(all_npy_files, load_trial, {data_label: npy_data}, workers=workers, desc=f"Merging the {data_label} data")
+
+    if out_filename is not None:
+        npy_data.flush()
+    if use_cache:
+        write_cache(input_data_folder, index, {data_label: npy_data})
     return npy_data
 
-def merge_behavior_data_mat_as_npy(input_data_folder, variable_name):
-    
-    all_mat_files = glob.glob(input_data_folder + "*.mat")
+def merge_behavioral_data_mat(input_data_folder, variable_names, workers=8, use_cache=True):
+    """
+    Reads the given variables from every per-trial .mat file of a folder (in natural sort order), parsing each
+    file only once and spreading the files across `workers` threads.  Returns a dict of arrays of shape (n_trials, ...),
+    one for each variable.  With use_cache, the arrays are read from (or saved to) the folder's consolidated cache,
+    as in merge_behavioral_data_npy().
+    """
+    all_mat_files = find_trial_files(input_data_folder, ".mat")
+    if not all_mat_files:
+        raise FileNotFoundError(f"No .mat files found in {input_data_folder}")
+
+    if use_cache:
+        index = source_index(all_mat_files)
+        cached = read_cache(input_data_folder, index)
+        if set(variable_names) <= set(cached):
+            return {name: cached[name] for name in variable_names}
+        # Also read the variables cached before, so that requests for different variables don't keep replacing each other
+        requested_names, variable_names = variable_names, [*variable_names, *(name for name in cached if name not in variable_names)]
+
+    def load_trial(filename):
+        mat_data_per_trial = loadmat(filename, variable_names=variable_names)
+        missing = set(variable_names) - set(mat_data_per_trial)
+        if missing:
+            raise KeyError(f"{filename} has no variable(s) {', '.join(sorted(missing))}")
+        return {name: mat_data_per_trial[name].squeeze() for name in variable_names}
 
-    mat_data = []
-    for filename in tqdm(all_mat_files, desc=f"Merging the {variable_name} position data"):
-        mat_data_per_trial = loadmat(filename)[variable_name].squeeze()
-        mat_data.append(mat_data_per_trial)
+    first_trial = load_trial(all_mat_files[0])
+    mat_data = {name: np.empty((len(all_mat_files), *data.shape), dtype=data.dtype) for name, data in first_trial.items()}
+    fill_trials(all_mat_files, load_trial, mat_data, workers=workers, desc=f"Merging the {', '.join(variable_names)} data")
+    if use_cache:
+        write_cache(input_data_folder, index, mat_data)
+        mat_data = {name: mat_data[name] for name in requested_names}
+    return mat_data
 
-    mat_data = np.stack(mat_data)
-    return mat_data
\ No newline at end of file
+def merge_behavior_data_mat_as_npy(input_data_folder, variable_name, workers=8, use_cache=True):
+    return merge_behavioral_data_mat(input_data_folder, [variable_name], workers=workers, use_cache=use_cache)[variable_name]
\ No newline at end of file
@@ -1,8 +1,29 @@
-def normalize(data, min_val=0, max_val=1):
+import numpy as np
 
-    # step 1: normalize between 0 and 1
-    data_nomred = data - data.min()
-    data_normed = data_nomred / data_nomred.max()
 
-    data_normed = data_normed * (max_val - min_val) + min_val
-    return data_normed
\ No newline at end of file
+def normalize(data, min_val=0, max_val=1, axis=None, out=None, inplace=False):
+    """
+    Rescales data to the range min_val to max_val, over all values or separately along axis
+    (e.g. axis=1 normalizes each trial of a (trial, time) array on its own).
+    Float data keeps its dtype (float32 stays float32); integer data is returned as float64.
+    The result is written into out if given, or into data itself with inplace=True, so that
+    no full-size temporary arrays are allocated.
+    """
+    data = np.asarray(data)
+    if inplace:
+        if not np.issubdtype(data.dtype, np.floating):
+            raise ValueError(f"Can't normalize {data.dtype} data in place; only float arrays can hold the result.")
+        out = data
+    elif out is None:
+        out = np.empty(data.shape, dtype=data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64)
+
+    data_min = data.min(axis=axis, keepdims=True)
+    data_range = data.max(axis=axis, keepdims=True) - data_min
+
+    # step 1: normalize between 0 and 1, then rescale to the requested range (all steps write into out)
+    np.subtract(data, data_min, out=out, casting='unsafe')
+    np.divide(out, data_range, out=out, casting='unsafe')
+    if max_val - min_val != 1:
+        np.multiply(out, max_val - min_val, out=out, casting='unsafe')
+    np.add(out, min_val, out=out, casting='unsafe')
+    return out
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Normalizes or standardizes .npy arrays without loading them into memory: the input is memory-mapped, its
+statistics are computed in a single streaming pass over chunks, and the result is written chunk by chunk.
+"""
+import numpy as np
+
+CHUNK_BYTES = 2 ** 26  # Size of the float64 working copy of each chunk
+
+
+def iter_chunks(array, chunk_bytes=CHUNK_BYTES):
+    """Yields slices along the first axis, each covering about chunk_bytes of float64 data.  A 0-d array is one chunk."""
+    if array.ndim == 0:
+        yield ...
+        return
+    row_bytes = 8 * max(int(np.prod(array.shape[1:])), 1)
+    rows_per_chunk = max(chunk_bytes // row_bytes, 1)
+    for start in range(0, array.shape[0], rows_per_chunk):
+        yield slice(start, start + rows_per_chunk)
+
+
+def _reduce(array, axis, chunk_stats, merge, chunk_bytes=CHUNK_BYTES):
+    """
+    Computes chunk_stats(chunk, axes) for every chunk and combines them into statistics for the whole array,
+    kept broadcastable against it (as with keepdims=True).  Chunks are stacked along the first axis if it isn't
+    reduced, and combined with merge(stats_a, stats_b) if it is.
+    """
+    axes = tuple(range(array.ndim)) if axis is None else tuple(np.atleast_1d(axis) % array.ndim)
+    merged = 0 in axes or array.ndim == 0  # A 0-d array has no first axis to stack along, but only one chunk
+    combined, stacked = None, []
+    for chunk_slice in iter_chunks(array, chunk_bytes):
+        stats = chunk_stats(np.asarray(array[chunk_slice], dtype=np.float64), axes)
+        if merged:
+            combined = stats if combined is None else merge(combined, stats)
+        else:
+            stacked.append(stats)
+    if merged:
+        return combined
+    return tuple(np.concatenate(parts) for parts in zip(*stacked))
+
+
+def min_max(array, axis=None, chunk_bytes=CHUNK_BYTES):
+    """Returns the minimum and maximum of array (along axis, or over all of it), read chunk by chunk."""
+    return _reduce(
+        array, axis,
+        chunk_stats=lambda chunk, axes: (chunk.min(axis=axes, keepdims=True), chunk.max(axis=axes, keepdims=True)),
+        merge=lambda a, b: (np.minimum(a[0], b[0]), np.maximum(a[1], b[1])),
+        chunk_bytes=chunk_bytes,
+    )
+
+
+def mean_std(array, axis=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Returns the mean and (population) standard deviation of array, read chunk by chunk.  Chunk statistics are
+    combined with Chan et al.'s parallel form of Welford's algorithm, which stays accurate where summing x and x**2 wouldn't.
+    """
+    def chunk_stats(chunk, axes):
+        mean = chunk.mean(axis=axes, keepdims=True)
+        m2 = ((chunk - mean) ** 2).sum(axis=axes, keepdims=True)
+        count = np.full(mean.shape, np.prod([chunk.shape[ax] for ax in axes]))
+        return count, mean, m2
+
+    def merge(a, b):
+        (count_a, mean_a, m2_a), (count_b, mean_b, m2_b) = a, b
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        return count, mean_a + delta * count_b / count, m2_a + m2_b + delta ** 2 * count_a * count_b / count
+
+    count, mean, m2 = _reduce(array, axis, chunk_stats=chunk_stats, merge=merge, chunk_bytes=chunk_bytes)
+    return mean, np.sqrt(m2 / count)
+
+
+def transform_file(input_array_path, output_array_path, offset, scale, chunk_bytes=CHUNK_BYTES):
+    """Writes (input - offset) / scale to output_array_path chunk by chunk, where offset and scale come from min_max() or mean_std()."""
+    input_array = np.load(input_array_path, mmap_mode='r')
+    dtype = input_array.dtype if np.issubdtype(input_array.dtype, np.floating) else np.float64
+    output_array_path = str(output_array_path)
+    if not output_array_path.endswith('.npy'):  # Like np.save()
+        output_array_path += '.npy'
+    output_array = np.lib.format.open_memmap(output_array_path, mode='w+', dtype=dtype, shape=input_array.shape)
+    for chunk_slice in iter_chunks(input_array, chunk_bytes):
+        # Statistics that vary along the first axis are sliced to match the chunk
+        chunk_offset = offset if offset.ndim == 0 or offset.shape[0] == 1 else offset[chunk_slice]
+        chunk_scale = scale if scale.ndim == 0 or scale.shape[0] == 1 else scale[chunk_slice]
+        out = output_array[chunk_slice]
+        np.subtract(input_array[chunk_slice], chunk_offset, out=out, casting='unsafe')
+        np.divide(out, chunk_scale, out=out, casting='unsafe')
+    output_array.flush()
+
+
+def normalize_file(input_array_path, output_array_path, axis=None, chunk_bytes=CHUNK_BYTES):
+    """Rescales the array in input_array_path to the range 0 to 1 (along axis, or over all of it) and saves it to output_array_path."""
+    min_val, max_val = min_max(np.load(input_array_path, mmap_mode='r'), axis=axis, chunk_bytes=chunk_bytes)
+    transform_file(input_array_path, output_array_path, offset=min_val, scale=max_val - min_val, chunk_bytes=chunk_bytes)
+
+
+def standardize_file(input_array_path, output_array_path, axis=None, chunk_bytes=CHUNK_BYTES):
+    """Shifts and scales the array in input_array_path to mean 0 and std 1 (along axis, or over all of it) and saves it to output_array_path."""
+    mean, std = mean_std(np.load(input_array_path, mmap_mode='r'), axis=axis, chunk_bytes=chunk_bytes)
+    transform_file(input_array_path, output_array_path, offset=mean, scale=std, chunk_bytes=chunk_bytes)
\ No newline at end of file
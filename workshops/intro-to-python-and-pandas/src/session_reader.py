@@ -0,0 +1,199 @@
+"""Finds processed Steinmetz session files through their catalog, reads them concurrently into trial tables, and writes those tables out per cohort."""
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from glob import glob
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+from typing import Callable, ContextManager, Iterable, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+T = TypeVar('T')
+
+# The HDF5 library behind NetCDF is not thread-safe, so reader threads take turns opening and reading files.
+# Worker processes each have their own copy of the library and don't take the lock (see map_sessions()).
+HDF5_LOCK = Lock()
+_lock_hdf5 = True
+
+# Worker processes are forked on Linux, so that scripts calling map_sessions() aren't run again in each worker (as
+# they would be with the spawn start method).  Elsewhere (e.g. on macOS, where forking is unsafe) they are spawned.
+FORK_CONTEXT = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
+
+CELL_VARIABLES = ['brain_area', 'brain_groups', 'trough_to_peak', 'ccf_ap', 'ccf_dv', 'ccf_lr']
+TRIAL_VARIABLES = ['active_trials', 'contrast_left', 'contrast_right', 'stim_onset', 'gocue', 'response_type', 'response_time', 'feedback_time', 'feedback_type', 'reaction_time', 'reaction_type']
+
+
+def find_sessions(pattern: str = 'data/processed/*.nc') -> list[str]:
+    """Returns the session files matching pattern, sorted so that results don't depend on the file system's order."""
+    return sorted(glob(pattern))
+
+
+def read_catalog(path: str = 'data/processed/catalog.parquet') -> pd.DataFrame:
+    """
+    Reads the session catalog written by 2_convert_to_netcdf.py: one row per session with its mouse, date, numbers of
+    cells and trials, brain areas and groups, and the path (made absolute here), size and sha256 checksum of its file.
+    """
+    catalog = pd.read_parquet(path)
+    catalog['path'] = [str((Path(path).parent / name).resolve()) for name in catalog['path']]
+    return catalog
+
+
+def select_sessions(
+    catalog: pd.DataFrame,
+    mouse: Optional[str] = None,
+    brain_areas: Iterable[str] = (),
+    brain_groups: Iterable[str] = (),
+    min_active_trials: int = 0,
+) -> pd.DataFrame:
+    """
+    Returns the catalog rows of the sessions of mouse (if given) that recorded all of brain_areas and brain_groups,
+    and have at least min_active_trials active trials, without opening any session file, e.g.:
+        paths = select_sessions(read_catalog(), brain_groups=['hippocampus'])['path']
+    """
+    keep = catalog['n_active_trials'] >= min_active_trials
+    if mouse is not None:
+        keep &= catalog['mouse'] == mouse
+    for column, wanted in [('brain_areas', set(brain_areas)), ('brain_groups', set(brain_groups))]:
+        if wanted:
+            keep &= np.array([wanted <= set(values) for values in catalog[column]], dtype=bool)
+    return catalog[keep]
+
+
+def hdf5_lock() -> ContextManager:
+    """Returns the context to hold around HDF5 calls: HDF5_LOCK in the main process, and nothing in map_sessions() worker processes."""
+    return HDF5_LOCK if _lock_hdf5 else nullcontext()
+
+
+def _init_worker_process() -> None:
+    global _lock_hdf5
+    _lock_hdf5 = False
+
+
+def default_executor() -> str:
+    """
+    Returns 'process' where worker processes can be forked safely: on Linux, from a process that runs no other threads.
+    Forking a process with threads (e.g. a Jupyter or VS Code kernel) can leave locks held in the children, so
+    everywhere else sessions are read by threads.
+    """
+    return 'process' if FORK_CONTEXT is not None and threading.active_count() == 1 else 'thread'
+
+
+def map_sessions(func: Callable[[str], T], paths: Iterable[str], workers: int = 8, executor: Optional[str] = None) -> list[T]:
+    """
+    Calls func(path) for every session path using a pool of `workers` processes or threads, and returns the
+    results in the order of paths.  Each process reads its files independently, overlapping both the waits on
+    (network) storage and decompression.  Threads have to take turns on HDF5_LOCK for all NetCDF access, so
+    they read one file at a time; they are only the default where processes can't be forked safely (see
+    default_executor()).  With processes, func must be importable (not defined in a notebook).
+    """
+    paths = list(paths)
+    executor = executor or default_executor()
+    if workers == 1:
+        return [func(path) for path in paths]
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=workers)
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=FORK_CONTEXT, initializer=_init_worker_process)
+    else:
+        raise ValueError(f"Unknown executor {executor!r}. Choose one of: thread, process.")
+    with pool:
+        return list(pool.map(func, paths))
+
+
+def session_id(mouse: str, session_date: str) -> str:
+    return str(md5((mouse + session_date).encode()).hexdigest())[:6]
+
+
+def read_trial_columns(path: str, variables: list[str] = TRIAL_VARIABLES) -> dict[str, np.ndarray]:
+    """Reads the trial coordinate, the given per-trial variables and the session attrs of one file, without loading anything else."""
+    with hdf5_lock(), xr.open_dataset(path) as dset:
+        n_trials = dset.sizes['trial']
+        columns = {name: dset[name].values for name in ['trial', *variables]}
+        columns['mouse'] = np.full(n_trials, dset.attrs['mouse'], dtype=object)
+        columns['session_date'] = np.full(n_trials, dset.attrs['session_date'], dtype=object)
+        columns['session_id'] = np.full(n_trials, session_id(dset.attrs['mouse'], dset.attrs['session_date']), dtype=object)
+    return columns
+
+
+def read_categorical(dset: xr.Dataset, name: str) -> pd.Categorical:
+    """Returns a string variable that is also stored as integer codes into a table of categories (e.g. brain_area) as a pandas Categorical."""
+    if f'{name}_code' not in dset:  # Written by an older converter, as strings only
+        return pd.Categorical(dset[name].values)
+    codes = dset[f'{name}_code']
+    return pd.Categorical.from_codes(codes.values, categories=dset[codes.attrs['categories']].values)
+
+
+def read_cell_columns(path: str, variables: list[str] = CELL_VARIABLES) -> dict[str, np.ndarray]:
+    """Reads the cell coordinate, the given per-cell variables (those stored as category codes as pandas Categoricals) and the session id of one file."""
+    with hdf5_lock(), xr.open_dataset(path) as dset:
+        n_cells = dset.sizes['cell']
+        columns = {'cell': dset['cell'].values}
+        for name in variables:
+            columns[name] = read_categorical(dset, name) if f'{name}_code' in dset else dset[name].values
+        columns['session_id'] = np.full(n_cells, session_id(dset.attrs['mouse'], dset.attrs['session_date']), dtype=object)
+    return columns
+
+
+def concat_columns(tables: list[dict[str, np.ndarray]]) -> pd.DataFrame:
+    """
+    Joins per-session column tables into one DataFrame, copying each column once into a preallocated array.
+    Categorical columns are joined into one Categorical with the union of their categories.
+    """
+    if not tables:
+        return pd.DataFrame()
+    offsets = np.cumsum([0] + [len(next(iter(table.values()))) for table in tables])
+    columns = {}
+    for name in tables[0]:
+        if isinstance(tables[0][name], pd.Categorical):
+            columns[name] = pd.api.types.union_categoricals([table[name] for table in tables], sort_categories=True)
+            continue
+        column = np.empty(offsets[-1], dtype=np.result_type(*[table[name].dtype for table in tables]))
+        for table, start, stop in zip(tables, offsets[:-1], offsets[1:]):
+            column[start:stop] = table[name]
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+def read_trial_table(paths: Iterable[str], variables: list[str] = TRIAL_VARIABLES, workers: int = 8, executor: Optional[str] = None) -> pd.DataFrame:
+    """Builds one table of the per-trial variables of all sessions, reading the sessions concurrently (see map_sessions())."""
+    tables = map_sessions(partial(read_trial_columns, variables=variables), paths, workers=workers, executor=executor)
+    df = concat_columns(tables)
+    # df = df[df['active_trials']].drop(columns=['active_trials'])
+    df = df.rename(columns={'gocue': 'gocue_time'})
+    return df
+
+
+def read_cell_table(paths: Iterable[str], variables: list[str] = CELL_VARIABLES, workers: int = 8, executor: Optional[str] = None) -> pd.DataFrame:
+    """Builds one table of the per-cell variables of all sessions, with brain_area and brain_groups as categorical columns."""
+    tables = map_sessions(partial(read_cell_columns, variables=variables), paths, workers=workers, executor=executor)
+    return concat_columns(tables)
+
+
+def assign_cohorts(session_dates: pd.Series, cohorts: dict[str, list[str]], default: str = 'other') -> pd.Series:
+    """Maps each session date to the name of the cohort (e.g. 'winter2016') whose list of dates contains it, or to default."""
+    date_to_cohort = {date: cohort for cohort, dates in cohorts.items() for date in dates}
+    return session_dates.map(date_to_cohort).fillna(default).astype(pd.CategoricalDtype([*cohorts, default]))
+
+
+def write_partitioned_parquet(df: pd.DataFrame, path: str, partition_cols: list[str] = ['cohort', 'mouse', 'session_date']) -> None:
+    """
+    Writes df in one pass as a Hive-partitioned Parquet dataset (e.g. cohort=winter2016/mouse=Cori/session_date=2016-12-14/),
+    replacing partitions written before, so that readers can load only the partitions they need:
+        pd.read_parquet(path, filters=[('cohort', '==', 'winter2016')])
+    """
+    df.to_parquet(path, partition_cols=partition_cols, index=False, existing_data_behavior='delete_matching')
+
+
+def write_group_csvs(df: pd.DataFrame, by: pd.Series, path_template: str, groups: Optional[Iterable[str]] = None) -> None:
+    """Groups df once by the values of `by` and writes each group (or only those in groups) to path_template.format(group)."""
+    groups = None if groups is None else set(groups)
+    for name, group in df.groupby(by, observed=True, sort=False):
+        if groups is None or name in groups:
+            group.to_csv(path_template.format(name), index=False)
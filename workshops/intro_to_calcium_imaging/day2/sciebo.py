@@ -1,7 +1,489 @@
-def download_file_from_sciebo(public_url, folder, filename):
-    import urllib.request
-    from pathlib import Path
-    path = Path(folder).joinpath(filename)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    data = urllib.request.urlopen(public_url + "/download").read()
-    path.write_bytes(data)
\ No newline at end of file
+"""
+Downloads files and folders from public share links on Sciebo.
+
+All downloads share one HTTP session, so repeated calls reuse the same connection.  Large files are fetched in
+several parallel byte ranges when the server supports it, and completed files are cached on disk (keyed by URL and
+ETag), so setting up a workshop a second time copies them from the cache instead of downloading them again.
+
+Folders can be unpacked while their zip archive is still arriving, without writing the archive to disk:
+    extract_folder(public_url, 'data/videos', members=['*.avi'])
+
+Many files can be downloaded at once from a manifest (a CSV or YAML file of url, destination and optional checksum):
+    python sciebo.py manifest.csv --workers 4
+"""
+import argparse
+import csv
+import fnmatch
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CACHE_DIR = Path(os.environ.get('SCIEBO_CACHE_DIR', Path.home() / '.cache' / 'sciebo'))
+TIMEOUT = (10, 60)  # Seconds to wait for the connection, and between received bytes
+MIN_CHUNK_SIZE = 2 ** 16  # Chunk sizes adapt to the connection's speed, between these bounds
+MAX_CHUNK_SIZE = 2 ** 24
+PARALLEL_MIN_SIZE = 2 ** 26  # Files at least this large are downloaded in parallel byte ranges
+PART_SIZE = 2 ** 24  # Size of each byte range
+WORKERS = 4  # Number of byte ranges downloaded at the same time
+BATCH_WORKERS = 4  # Number of files downloaded at the same time in batch mode
+IDENTITY_ENCODING = {'Accept-Encoding': 'identity'}  # So that sizes and byte ranges refer to the file, not a compressed body
+
+_session: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    """Returns the HTTP session shared by all downloads, creating it on first use."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=WORKERS, pool_maxsize=WORKERS * BATCH_WORKERS, max_retries=3)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def download_file(
+    public_url,
+    to_filename,
+    use_cache: bool = True,
+    checksum: Optional[str] = None,
+    skip_existing: bool = False,
+    progress_bar: Optional['_ProgressBar'] = None,
+) -> Path:
+    """
+    Downloads a file from a shared URL on Sciebo.  If a checksum ('sha256:<hex>', or another hashlib algorithm) is given,
+    the downloaded file is verified against it.  With skip_existing, a file already at to_filename with the right size
+    (and checksum, if given) is kept instead.  If the server doesn't report the size of the file (or only sends it
+    compressed), it is downloaded with a plain GET request, without parallel ranges or the cache.
+    """
+    url = public_url + "/download"
+    path = Path(to_filename)
+    _make_parent_folders(path)
+
+    r = get_session().head(url, headers=IDENTITY_ENCODING, allow_redirects=True, timeout=TIMEOUT)
+    if r.status_code == 404:
+        raise IOError(f"Data not found at {public_url}")
+    r.raise_for_status()
+    num_bytes = int(r.headers['Content-Length']) if 'Content-Length' in r.headers and not _is_encoded(r) else None
+    etag = r.headers.get('ETag')
+
+    if skip_existing and path.exists() and (path.stat().st_size == num_bytes if num_bytes is not None else bool(checksum)) and (not checksum or _matches(path, checksum)):
+        return path
+
+    # Without a size, a cached or partly downloaded file can't be told apart from a complete one
+    cache_path = _cache_path(url, etag) if use_cache and num_bytes is not None else None
+    if cache_path and cache_path.exists() and cache_path.stat().st_size == num_bytes:
+        _copy(cache_path, path)
+    else:
+        part_path = path.with_name(path.name + '.part')
+        own_progress_bar = progress_bar is None
+        if own_progress_bar:
+            progress_bar = _ProgressBar(desc=f"Downloading {to_filename}", unit='B', unit_scale=True, total=num_bytes)
+        elif num_bytes is not None:
+            progress_bar.add_total(num_bytes)
+        if num_bytes is not None and num_bytes >= PARALLEL_MIN_SIZE and r.headers.get('Accept-Ranges') == 'bytes':
+            _download_ranges(url, part_path, num_bytes, progress_bar)
+        else:
+            with get_session().get(url, headers=IDENTITY_ENCODING, stream=True, timeout=TIMEOUT) as r:
+                r.raise_for_status()
+                if _is_encoded(r):  # Compressed anyway, so the decoded file can't be checked against the body's length
+                    num_bytes = None
+                with open(part_path, 'wb') as f:
+                    _stream(r, f, progress_bar)
+        if own_progress_bar:
+            progress_bar.close()
+        if num_bytes is not None and part_path.stat().st_size != num_bytes:
+            raise IOError(f"Download of {public_url} ended after {part_path.stat().st_size} of {num_bytes} bytes.")
+        part_path.replace(path)
+        if cache_path:
+            _store(path, cache_path)
+
+    if checksum and not _matches(path, checksum):
+        path.unlink()
+        raise IOError(f"Checksum of {path} does not match {checksum}; the file was deleted.")
+    return path
+
+
+def download_folder(public_url, to_filename) -> Path:
+    """Downloads a folder from a shared URL on Sciebo, as a zip archive."""
+    path = Path(to_filename)
+    _make_parent_folders(path)
+
+    progress_bar = _ProgressBar(desc=f"Downloading {to_filename}", unit='B', unit_scale=True)
+    with get_session().get(public_url + "/download", stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        with open(path, 'wb') as f:
+            _stream(r, f, progress_bar)
+    progress_bar.close()
+    return path
+
+
+def extract_folder(public_url, to_folder, members: Optional[list[str]] = None) -> list[Path]:
+    """
+    Downloads a folder from a shared URL on Sciebo and unpacks it into to_folder while it downloads, so the
+    zip archive is never written to disk.  If members (glob patterns, e.g. ['day1/*.tif']) are given, only the
+    matching files are extracted.  Returns the paths of the extracted files.
+    """
+    to_folder = Path(to_folder)
+    to_folder.mkdir(parents=True, exist_ok=True)
+    progress_bar = _ProgressBar(desc=f"Downloading {to_folder}", unit='B', unit_scale=True)
+    try:
+        with get_session().get(public_url + "/download", stream=True, timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            return _extract_zip_stream(_ZipStream(r, progress_bar), to_folder, members)
+    except _UnsupportedZip:
+        # Archives that can't be read front to back (e.g. encrypted ones) are downloaded whole and unpacked afterwards
+        with tempfile.TemporaryDirectory(dir=to_folder) as tmp_dir:
+            archive = download_folder(public_url, Path(tmp_dir) / 'folder.zip')
+            with zipfile.ZipFile(archive) as zf:
+                names = [name for name in zf.namelist() if not name.endswith('/') and _wanted(name, members)]
+                return [Path(zf.extract(name, to_folder)) for name in names]
+    finally:
+        progress_bar.close()
+
+
+def download_from_sciebo(public_url, to_filename, is_file = True, extract = False, members: Optional[list[str]] = None):
+    """
+    Wrapper function: Downloads a file or folder from a shared URL on Sciebo.
+    With extract=True, a folder is unpacked into to_filename while it downloads (see extract_folder()).
+    """
+    if not is_file and extract:
+        return extract_folder(public_url=public_url, to_folder=to_filename, members=members)
+    download_fun = download_file if is_file else download_folder
+    return download_fun(public_url=public_url, to_filename=to_filename)
+
+
+def download_file_from_sciebo(public_url, folder, filename) -> Path:
+    """Downloads a file from a shared URL on Sciebo into folder/filename."""
+    return download_file(public_url=public_url, to_filename=Path(folder) / filename)
+
+
+class ManifestEntry(NamedTuple):
+    url: str
+    destination: str
+    checksum: Optional[str] = None
+
+
+def read_manifest(path: Union[Path, str]) -> list[ManifestEntry]:
+    """
+    Reads a download manifest: a CSV file with the columns url, destination and (optionally) checksum,
+    or a YAML file holding a list of entries with the same keys (YAML needs the pyyaml package).
+    """
+    path = Path(path)
+    if path.suffix in ['.yml', '.yaml']:
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML manifests needs the pyyaml package: pip install pyyaml")
+        rows = yaml.safe_load(path.read_text()) or []
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+    return [ManifestEntry(url=row['url'], destination=row['destination'], checksum=row.get('checksum') or None) for row in rows]
+
+
+def download_batch(entries: list[ManifestEntry], workers: int = BATCH_WORKERS, use_cache: bool = True) -> list[str]:
+    """
+    Downloads all manifest entries, `workers` files at a time, with one progress bar for all of them.
+    Files already present with the right size and checksum are skipped.  A failing download doesn't stop
+    the others; the error messages of all failed downloads are returned.
+    """
+    errors = []
+    progress_bar = _ProgressBar(desc=f"Downloading {len(entries)} files", unit='B', unit_scale=True, total=0)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(download_file, entry.url, entry.destination, use_cache=use_cache, checksum=entry.checksum, skip_existing=True, progress_bar=progress_bar): entry
+            for entry in entries
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(f"{futures[future].destination}: {error!r}")
+    progress_bar.close()
+    return errors
+
+
+def _matches(path: Path, checksum: str) -> bool:
+    algorithm, _, expected = checksum.rpartition(':')
+    digest = hashlib.new(algorithm or 'sha256')
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 23), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == expected.lower()
+
+
+def _is_encoded(r: requests.Response) -> bool:
+    return r.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+
+def _stream(r: requests.Response, f, progress_bar: '_ProgressBar') -> None:
+    """Copies the body of r into f, growing the chunk size while chunks arrive quickly and shrinking it when they don't."""
+    chunk_size = MIN_CHUNK_SIZE
+    while True:
+        start = time.perf_counter()
+        chunk = r.raw.read(chunk_size, decode_content=True)
+        if not chunk:
+            break
+        f.write(chunk)
+        progress_bar.update(len(chunk))
+        elapsed = time.perf_counter() - start
+        if elapsed < 0.1:
+            chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+        elif elapsed > 1:
+            chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+
+
+def _download_ranges(url: str, path: Path, num_bytes: int, progress_bar: '_ProgressBar') -> None:
+    """Downloads url into path as PART_SIZE byte ranges, WORKERS at a time, each written at its own offset."""
+    with open(path, 'wb') as f:
+        f.truncate(num_bytes)
+
+    def download_range(start: int) -> None:
+        stop = min(start + PART_SIZE, num_bytes)
+        headers = {**IDENTITY_ENCODING, 'Range': f'bytes={start}-{stop - 1}'}
+        with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError(f"Server did not return the requested byte range of {url}")
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                _stream(r, f, progress_bar)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        list(pool.map(download_range, range(0, num_bytes, PART_SIZE)))
+
+
+class _UnsupportedZip(Exception):
+    pass
+
+
+class _ZipStream:
+    """Reads an HTTP response body front to back, with the ability to push back bytes that were read too far."""
+
+    def __init__(self, r: requests.Response, progress_bar: '_ProgressBar') -> None:
+        self.raw = r.raw
+        self.progress_bar = progress_bar
+        self.buffer = b''
+
+    def read_some(self) -> bytes:
+        """Returns the next available bytes (an empty result at the end of the stream)."""
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+            return data
+        data = self.raw.read(MIN_CHUNK_SIZE * 16, decode_content=True)
+        self.progress_bar.update(len(data))
+        return data
+
+    def read(self, n: int) -> bytes:
+        """Returns exactly n bytes."""
+        data = b''
+        while len(data) < n:
+            chunk = self.read_some()
+            if not chunk:
+                raise IOError("Zip archive ended unexpectedly")
+            data += chunk
+        self.unread(data[n:])
+        return data[:n]
+
+    def unread(self, data: bytes) -> None:
+        self.buffer = data + self.buffer
+
+
+def _wanted(name: str, members: Optional[list[str]]) -> bool:
+    return members is None or any(fnmatch.fnmatch(name, pattern) for pattern in members)
+
+
+def _extract_zip_stream(stream: _ZipStream, to_folder: Path, members: Optional[list[str]]) -> list[Path]:
+    """Unpacks the zip archive in stream member by member, reading each local file header and the data after it."""
+    root = to_folder.resolve()
+    extracted = []
+    while stream.read(4) == b'PK\x03\x04':  # Local file headers come first; the central directory that follows is not needed
+        _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length = struct.unpack('<HHHHHIIIHH', stream.read(26))
+        name = stream.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = stream.read(extra_length)
+        zip64 = False
+        while len(extra) >= 4:
+            field_id, field_length = struct.unpack('<HH', extra[:4])
+            if field_id == 0x0001:  # Zip64 sizes
+                zip64 = True
+                sizes = iter(struct.unpack(f'<{field_length // 8}Q', extra[4:4 + field_length // 8 * 8]))
+                size = next(sizes) if size == 0xFFFFFFFF else size
+                compressed_size = next(sizes) if compressed_size == 0xFFFFFFFF else compressed_size
+            extra = extra[4 + field_length:]
+        if flags & 0x1 or method not in [0, 8]:
+            raise _UnsupportedZip(f"{name}: encrypted or compressed with method {method}")
+
+        path = (to_folder / name).resolve()
+        if name.endswith('/') or not _wanted(name, members):
+            f = None
+        elif root not in path.parents:
+            raise IOError(f"Zip member {name} would be extracted outside of {to_folder}")
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = open(path.with_name(path.name + '.part'), 'wb')
+        has_descriptor = bool(flags & 0x8)
+        try:
+            if method == 8:
+                actual_crc = _inflate(stream, f)
+            elif has_descriptor and compressed_size == 0:
+                actual_crc = _copy_until_descriptor(stream, f, zip64)
+            else:
+                actual_crc = _copy_exact(stream, f, compressed_size)
+        finally:
+            if f:
+                f.close()
+        if has_descriptor:
+            descriptor = stream.read(4)
+            if descriptor == b'PK\x07\x08':
+                descriptor = stream.read(4)
+            crc = struct.unpack('<I', descriptor)[0]
+            stream.read(16 if zip64 else 8)
+        if f:
+            if actual_crc != crc:
+                raise IOError(f"CRC check failed for zip member {name}")
+            path.with_name(path.name + '.part').replace(path)
+            extracted.append(path)
+    return extracted
+
+
+def _inflate(stream: _ZipStream, f) -> int:
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc = 0
+    while not decompressor.eof:
+        data = stream.read_some()
+        if not data:
+            raise IOError("Zip archive ended unexpectedly")
+        out = decompressor.decompress(data)
+        crc = zlib.crc32(out, crc)
+        if f:
+            f.write(out)
+    stream.unread(decompressor.unused_data)
+    return crc
+
+
+def _copy_exact(stream: _ZipStream, f, n: int) -> int:
+    crc = 0
+    while n:
+        data = stream.read_some()
+        if not data:
+            raise IOError("Zip archive ended unexpectedly")
+        data, rest = data[:n], data[n:]
+        stream.unread(rest)
+        n -= len(data)
+        crc = zlib.crc32(data, crc)
+        if f:
+            f.write(data)
+    return crc
+
+
+def _copy_until_descriptor(stream: _ZipStream, f, zip64: bool) -> int:
+    """
+    Copies a stored member whose size is only given in the data descriptor after it, by looking for a descriptor
+    signature whose CRC and size match the data before it.
+    """
+    descriptor_length = 24 if zip64 else 16
+    crc, n, pending = 0, 0, b''
+    while True:
+        data = stream.read_some()
+        if not data:
+            raise IOError("Zip archive ended unexpectedly")
+        pending += data
+        position = pending.find(b'PK\x07\x08')
+        while position != -1 and position + descriptor_length <= len(pending):
+            expected_crc, compressed_size = struct.unpack('<IQ' if zip64 else '<II', pending[position + 4:position + descriptor_length - (8 if zip64 else 4)])
+            if compressed_size == n + position and zlib.crc32(pending[:position], crc) == expected_crc:
+                if f:
+                    f.write(pending[:position])
+                stream.unread(pending[position:])
+                return expected_crc
+            position = pending.find(b'PK\x07\x08', position + 1)
+        # Bytes from a signature without enough data after it yet, or a partial signature at the end, are kept for the next round
+        keep_from = position if position != -1 else max(len(pending) - 3, 0)
+        done, pending = pending[:keep_from], pending[keep_from:]
+        crc = zlib.crc32(done, crc)
+        n += len(done)
+        if f:
+            f.write(done)
+
+
+def _cache_path(url: str, etag: Optional[str]) -> Optional[Path]:
+    # Without an ETag there is no way to tell whether the file changed, so it isn't cached
+    if not etag:
+        return None
+    return CACHE_DIR / hashlib.sha256(f'{url}\n{etag}'.encode()).hexdigest()
+
+
+def _store(path: Path, cache_path: Path) -> None:
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix('.tmp')
+        shutil.copyfile(path, tmp_path)
+        tmp_path.replace(cache_path)
+    except OSError:  # A full or read-only cache shouldn't fail the download
+        pass
+
+
+def _copy(src: Path, dst: Path) -> None:
+    # A real copy rather than a hard link, so editing the file in place can't change the cache entry or other copies of it
+    tmp_path = dst.with_name(dst.name + '.part')
+    shutil.copyfile(src, tmp_path)
+    tmp_path.replace(dst)
+
+
+def _make_parent_folders(path: Union[Path, str]) -> None:
+    # Create the parent folders if a longer path was described
+    path = Path(path)
+    if len(path.parts) > 1:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+
+class _ProgressBar:
+    def __init__(self, desc=None, unit=None, unit_scale=True, total=None) -> None:
+        """Creates tqdm progress bar if tqdm is installed, else acts as a Null operator."""
+        self.pbar: Optional['tqdm']
+        self.lock = threading.Lock()
+        try:
+            from tqdm import tqdm
+            self.pbar = tqdm(desc=desc, unit=unit, unit_scale=unit_scale, total=total)
+        except (ModuleNotFoundError, ImportError):
+            self.pbar = None
+
+    def update(self, nbytes: int) -> None:
+        if self.pbar is not None:
+            self.pbar.update(nbytes)
+
+    def add_total(self, nbytes: int) -> None:
+        if self.pbar is not None:
+            with self.lock:
+                self.pbar.total += nbytes
+                self.pbar.refresh()
+
+    def close(self) -> None:
+        if self.pbar is not None:
+            self.pbar.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Download the files listed in a manifest (CSV or YAML of url, destination, checksum) from Sciebo.')
+    parser.add_argument('manifest', type=Path, help='CSV or YAML manifest file')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='Number of files to download at the same time (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help=f'Don\'t use or fill the download cache in {CACHE_DIR}')
+    args = parser.parse_args()
+
+    errors = download_batch(read_manifest(args.manifest), workers=args.workers, use_cache=not args.no_cache)
+    if errors:
+        raise IOError(f"{len(errors)} file(s) could not be downloaded:\n" + "\n".join(errors))
\ No newline at end of file
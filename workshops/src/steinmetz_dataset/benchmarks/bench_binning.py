@@ -0,0 +1,52 @@
+"""Compares binning raw spikes with SpikeIndex.bin_counts() against a pandas groupby over the spike table, for a few bin widths and alignments."""
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from synthetic_session import SCRIPTS_PATH, load_script, make_session
+
+sys.path.insert(0, str(SCRIPTS_PATH))
+from spikes import SpikeIndex
+
+
+def groupby_bin_counts(dset: xr.Dataset, bin_size: float, align: str, window: tuple[float, float]) -> np.ndarray:
+    """The pandas approach: align and bin every spike in a DataFrame, count per (cell, trial, bin), and fill a dense cube."""
+    df = pd.DataFrame({'cell': dset['spike_cell'].values, 'trial': dset['spike_trial'].values, 'time': dset['spike_time'].values.astype(np.float64)})
+    if align is not None:
+        df['time'] -= df['trial'].map(dset[align].to_series())
+    df['bin'] = np.floor((df['time'] - window[0]) / bin_size)
+    n_bins = int(round((window[1] - window[0]) / bin_size))
+    df = df[(df['bin'] >= 0) & (df['bin'] < n_bins)]
+    counts = df.groupby(['cell', 'trial', 'bin']).size()
+
+    cube = np.zeros((dset.sizes['cell'], dset.sizes['trial'], n_bins), dtype=np.int64)
+    cells, trials, bins = (counts.index.get_level_values(level).to_numpy() for level in range(3))
+    cube[cells - 1, trials - 1, bins.astype(int)] = counts.values
+    return cube
+
+
+def timed(fun, *args, **kwargs):
+    start = perf_counter()
+    result = fun(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    dd_part, dd_st, dd_wav, dd_lfp = make_session()
+    dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)
+    index = SpikeIndex(dset)
+    print(f'{len(index.spikes.time):,} spikes, {dset.sizes["cell"]} cells, {dset.sizes["trial"]} trials')
+
+    for bin_size, align, window in [(0.01, None, (0., 2.5)), (0.05, 'gocue', (-0.5, 1.)), (0.002, 'response_time', (-0.2, 0.2))]:
+        expected, t_pandas = timed(groupby_bin_counts, dset, bin_size=bin_size, align=align, window=window)
+        counts, t_index = timed(index.bin_counts, bin_size, align=align, window=window)
+        data = counts.data.todense() if hasattr(counts.data, 'todense') else counts.data
+        assert np.array_equal(data, expected)
+
+        kind = f'sparse, {counts.data.nbytes / 2 ** 20:.1f} MB' if hasattr(counts.data, 'todense') else f'dense {counts.dtype}, {counts.nbytes / 2 ** 20:.1f} MB'
+        print(f'{bin_size * 1000:g} ms bins, aligned to {align or "trial start"}: pandas groupby {t_pandas:6.3f} s, '
+              f'bin_counts {t_index:6.3f} s ({t_pandas / t_index:.0f}x faster; {kind})')
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Compares labeling cells with brain groups, and filtering and grouping cells by region, as strings and as categories."""
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from synthetic_session import load_script
+
+N_CELLS = 40_000  # About as many cells as all sessions together
+
+
+def timed(fun, repeats: int = 5) -> tuple:
+    start = perf_counter()
+    for _ in range(repeats):
+        result = fun()
+    return result, (perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    areas = np.array(sorted(convert.get_brain_group_dict()) + ['root'])
+    brain_area = np.random.default_rng(0).choice(areas, size=N_CELLS)
+
+    groups_loop, t_loop = timed(lambda: [convert.get_brain_group_dict().get(area, area) for area in brain_area])
+    groups_vec, t_vec = timed(lambda: convert.label_brain_groups(brain_area))
+    assert groups_vec.tolist() == groups_loop
+    print(f'{N_CELLS:,} cells, {len(areas)} areas')
+    print(f'label groups    per cell: {t_loop * 1e3:7.2f} ms   per distinct area: {t_vec * 1e3:7.2f} ms  ({t_loop / t_vec:.0f}x faster)')
+
+    as_strings = pd.DataFrame({'brain_area': brain_area.astype(object), 'brain_groups': np.array(groups_loop, dtype=object), 'rate': 1.})
+    as_categories = as_strings.astype({'brain_area': 'category', 'brain_groups': 'category'})
+    for name, query in [
+        ('filter one area', lambda df: df[df['brain_area'] == 'CA1']),
+        ('filter areas', lambda df: df[df['brain_area'].isin(['CA1', 'CA3', 'DG'])]),
+        ('group by group', lambda df: df.groupby('brain_groups', observed=True)['rate'].mean()),
+    ]:
+        (expected, t_str), (result, t_cat) = timed(lambda: query(as_strings)), timed(lambda: query(as_categories))
+        assert len(expected) == len(result)
+        print(f'{name:15} strings:  {t_str * 1e3:7.2f} ms   categories:        {t_cat * 1e3:7.2f} ms  ({t_str / t_cat:.0f}x faster)')
+
+    print(f'memory          strings:  {as_strings.memory_usage(deep=True).sum() / 2 ** 20:7.2f} MB   categories:        {as_categories.memory_usage(deep=True).sum() / 2 ** 20:7.2f} MB')
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""Compares finding the sessions that recorded an area by opening every session file against filtering the session catalog."""
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import xarray as xr
+
+from synthetic_session import SCRIPTS_PATH, load_script, make_session
+
+sys.path.insert(0, str(SCRIPTS_PATH))
+from session_reader import find_sessions, read_catalog, read_categorical, select_sessions
+
+N_SESSIONS = 39
+
+
+def scan_files(paths: list[str], brain_group: str) -> list[str]:
+    """The approach without a catalog: open each file and check its brain_groups."""
+    found = []
+    for path in paths:
+        with xr.open_dataset(path) as dset:
+            if brain_group in set(read_categorical(dset, 'brain_groups')):
+                found.append(path)
+    return found
+
+
+def timed(fun, *args, **kwargs):
+    start = perf_counter()
+    result = fun(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    with TemporaryDirectory() as tmp:
+        base_path = Path(tmp)
+        manifest = convert.Manifest(path=base_path / 'manifest.json', raw_path=base_path)
+        for idx in range(N_SESSIONS):
+            dd_part, dd_st, dd_wav, dd_lfp = make_session(n_cells=100 + 10 * idx, n_active=50, n_passive=20, seed=idx)
+            dd_part['date_exp'] = f'2017-01-{idx + 1:02d}'
+            if idx % 3:  # Only some sessions record hippocampus
+                dd_part['brain_area'][dd_part['brain_area'] == 'CA1'] = 'VISp'
+            session_path, summary = convert.convert_session(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st, base_path=base_path)
+            manifest.record(convert.SessionSource('steinmetz_part0.npz', idx), session_path, summary)
+        manifest.write_catalog(base_path / 'catalog.parquet')
+
+        scanned, t_scan = timed(scan_files, find_sessions(str(base_path / '*.nc')), brain_group='hippocampus')
+        selected, t_catalog = timed(lambda: select_sessions(read_catalog(str(base_path / 'catalog.parquet')), brain_groups=['hippocampus'])['path'].tolist())
+        assert scanned == selected
+
+        print(f'{len(selected)} of {N_SESSIONS} sessions recorded hippocampus')
+        print(f'opening every file: {t_scan * 1e3:8.1f} ms')
+        print(f'session catalog:    {t_catalog * 1e3:8.1f} ms  ({t_scan / t_catalog:.0f}x faster)')
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""Times the raw-data downloader against a local stand-in server, and checks that interrupted downloads resume and corrupt ones are caught."""
+import argparse
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import requests
+
+from local_http_server import serve
+from synthetic_session import load_script
+
+
+def download_sequential(downloads, base_path: Path) -> None:
+    """The original script: one request after another, each response held in memory before being written."""
+    for url, subdir, fname in downloads:
+        path = base_path / subdir / fname
+        path.parent.mkdir(parents=True, exist_ok=True)
+        r = requests.get(url)
+        r.raise_for_status()
+        path.write_bytes(r.content)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=float, default=8, help='Size of each of the six files (default: %(default)s)')
+    parser.add_argument('--bandwidth-mb', type=float, default=20, help='Bandwidth of each connection, in MB/s (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before each response starts (default: %(default)s)')
+    args = parser.parse_args()
+
+    download = load_script('1_download_data')
+    files = {f'/{d.subdir}/{d.fname}': os.urandom(int(args.size_mb * 1e6)) for d in download.urls}
+    with serve(files, latency=args.latency, bandwidth=args.bandwidth_mb * 1e6) as server, TemporaryDirectory() as tmp_dir:
+        downloads = [d._replace(url=f'{server.url}/{d.subdir}/{d.fname}') for d in download.urls]
+
+        start = perf_counter()
+        download_sequential(downloads, Path(tmp_dir) / 'sequential')
+        print(f'Sequential, in memory: {perf_counter() - start:.2f} s')
+
+        base_path = Path(tmp_dir) / 'concurrent'
+        manifest_path = base_path / 'checksums.json'
+        start = perf_counter()
+        errors = download.download_all(downloads, base_path=base_path, manifest_path=manifest_path)
+        print(f'Concurrent, streamed: {perf_counter() - start:.2f} s')
+        assert not errors, errors
+        for d in downloads:
+            assert (base_path / d.subdir / d.fname).read_bytes() == files[f'/{d.subdir}/{d.fname}']
+
+        start = perf_counter()
+        download.download_all(downloads, base_path=base_path, manifest_path=manifest_path)
+        print(f'Re-run with verified files present: {perf_counter() - start:.2f} s')
+
+        # Simulate an interrupted download, then resume it
+        target = base_path / downloads[0].subdir / downloads[0].fname
+        original = target.read_bytes()
+        target.unlink()
+        target.with_name(target.name + '.part').write_bytes(original[:len(original) // 2])
+        n_requests = len(server.requests)
+        download.download_all(downloads[:1], base_path=base_path, manifest_path=manifest_path)
+        assert server.requests[n_requests][1].get('Range') == f'bytes={len(original) // 2}-'
+        assert target.read_bytes() == original
+        print('Resumed a half-downloaded file with a Range request.')
+
+        # A file that changed on the server no longer matches the manifest
+        files[f'/{downloads[1].subdir}/{downloads[1].fname}'] = os.urandom(1000)
+        (base_path / downloads[1].subdir / downloads[1].fname).unlink()
+        errors = download.download_all(downloads[1:2], base_path=base_path, manifest_path=manifest_path)
+        assert len(errors) == 1 and 'Checksum' in errors[0], errors
+        print('Rejected a file whose checksum does not match the manifest.')
@@ -0,0 +1,28 @@
+"""Reports the memory and disk space that compact_dtypes() saves on a synthetic session, per variable and in total."""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from synthetic_session import load_script, make_session
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    dd_part, dd_st, dd_wav, dd_lfp = make_session()
+    dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st, compact=False)
+
+    start = perf_counter()
+    compact, report = convert.compact_dtypes(dset)
+    planning_time = perf_counter() - start
+
+    report['saved_mb'] = (report['nbytes_before'] - report['nbytes_after']) / 1e6
+    print(report[report['dtype_before'] != report['dtype_after']].round(2).to_string())
+    print(f"\nMemory: {dset.nbytes / 1e6:.0f} MB -> {compact.nbytes / 1e6:.0f} MB (planned and cast in {planning_time:.2f} s)")
+
+    with TemporaryDirectory() as tmp_dir:
+        sizes = {}
+        for label, data in [('original', dset), ('compact', compact)]:
+            path = Path(tmp_dir) / f'{label}.nc'
+            convert.write_dataset(data, path=path, **convert.STORAGE_SETTINGS)
+            sizes[label] = path.stat().st_size / 1e6
+    print(f"Disk:   {sizes['original']:.0f} MB -> {sizes['compact']:.0f} MB")
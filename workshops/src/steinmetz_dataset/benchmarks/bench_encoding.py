@@ -0,0 +1,112 @@
+"""
+Measures write time, read time and compressed size of every variable of a session across codecs, compression
+levels and shuffle settings, and writes a recommended per-variable encoding table for the converter:
+
+    python benchmarks/bench_encoding.py --session data/processed/steinmetz_2017-01-08_Cori.nc --output encoding_table.json
+    python scripts/2_convert_to_netcdf.py --encoding-table encoding_table.json
+
+For each variable, the recommendation is the fastest-to-write setting whose size is within --size-tolerance of
+the size with the converter's default settings.
+"""
+import argparse
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pandas as pd
+import xarray as xr
+
+from synthetic_session import load_script, make_session
+
+COMPLEVELS = {'zlib': [1, 3, 5, 9], 'zstd': [1, 3, 9], 'blosc': [1, 5, 9], 'lz4': [1]}
+BACKEND_COMPRESSORS = {'netcdf': ['zlib', 'zstd'], 'zarr': ['zlib', 'zstd', 'blosc', 'lz4']}
+
+
+def disk_size(path: Path) -> int:
+    return path.stat().st_size if path.is_file() else sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+def benchmark_variables(dset: xr.Dataset, backend: str, write_dataset, suffix: str) -> pd.DataFrame:
+    rows = []
+    with TemporaryDirectory() as tmp_dir:
+        for name, var in dset.data_vars.items():
+            if 'U' in str(var.dtype):
+                continue
+            variable = dset[[name]].drop_vars(list(dset[[name]].coords))  # only measure the variable itself
+            for compressor in BACKEND_COMPRESSORS[backend]:
+                for complevel in COMPLEVELS[compressor]:
+                    for shuffle in [True, False]:
+                        path = Path(tmp_dir) / f'{name}_{compressor}{complevel}_{shuffle}{suffix}'
+                        start = perf_counter()
+                        try:
+                            write_dataset(variable, path=path, backend=backend, compressor=compressor, complevel=complevel, shuffle=shuffle)
+                        except RuntimeError as error:  # e.g. zstd missing from the installed HDF5 plugins
+                            print(f'Skipping {name} {compressor}/{complevel}: {error!r}')
+                            continue
+                        write_time = perf_counter() - start
+
+                        start = perf_counter()
+                        with xr.open_dataset(path) as written:
+                            written[name].load()
+                        read_time = perf_counter() - start
+
+                        rows.append({
+                            'variable': name,
+                            'dtype': str(var.dtype),
+                            'compressor': compressor,
+                            'complevel': complevel,
+                            'shuffle': shuffle,
+                            'write_s': write_time,
+                            'read_s': read_time,
+                            'size_mb': disk_size(path) / 1e6,
+                        })
+    return pd.DataFrame(rows)
+
+
+def recommend(results: pd.DataFrame, default: dict, size_tolerance: float) -> pd.DataFrame:
+    """
+    Picks, per variable, the fastest-to-write setting whose size is at most size_tolerance larger than with the
+    default settings.  Returns one row per variable, with the default setting's write time and size alongside.
+    """
+    is_default = (
+        (results['compressor'] == default['compressor'])
+        & (results['complevel'] == default['complevel'])
+        & (results['shuffle'] == default['shuffle'])
+    )
+    default_results = results[is_default].set_index('variable')[['write_s', 'size_mb']]
+    results = results.join(default_results, on='variable', rsuffix='_default')
+    candidates = results[results['size_mb'] <= results['size_mb_default'] * (1 + size_tolerance)]
+    best = candidates.sort_values(['write_s', 'read_s']).groupby('variable', sort=False).head(1)
+    return best.set_index('variable').sort_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark compression settings per variable and recommend an encoding table.')
+    parser.add_argument('--session', type=Path, help='A converted session file to benchmark (default: a synthetic session)')
+    parser.add_argument('--backend', choices=list(BACKEND_COMPRESSORS), default='netcdf')
+    parser.add_argument('--size-tolerance', type=float, default=0.1, help='Extra size, relative to the default settings, accepted for a faster write (default: %(default)s)')
+    parser.add_argument('--output', type=Path, default=Path('encoding_table.json'), help='Where to write the recommended encoding table (default: %(default)s)')
+    args = parser.parse_args()
+
+    convert = load_script('2_convert_to_netcdf')
+    if args.session:
+        dset = xr.load_dataset(args.session)
+    else:
+        dd_part, dd_st, dd_wav, dd_lfp = make_session()
+        dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)
+
+    results = benchmark_variables(dset, backend=args.backend, write_dataset=convert.write_dataset, suffix=convert.BACKEND_SUFFIXES[args.backend])
+    best = recommend(results, default=convert.STORAGE_SETTINGS, size_tolerance=args.size_tolerance)
+
+    summary = best[['dtype', 'compressor', 'complevel', 'shuffle', 'write_s', 'size_mb', 'write_s_default', 'size_mb_default']]
+    print(summary.round(3).to_string())
+    print(f"\nTotal write time: {summary['write_s'].sum():.2f} s (default settings: {summary['write_s_default'].sum():.2f} s)")
+    print(f"Total size: {summary['size_mb'].sum():.1f} MB (default settings: {summary['size_mb_default'].sum():.1f} MB)")
+
+    table = {
+        name: {'compressor': row['compressor'], 'complevel': int(row['complevel']), 'shuffle': bool(row['shuffle'])}
+        for name, row in best.iterrows()
+    }
+    args.output.write_text(json.dumps(table, indent=2))
+    print(f'Wrote encoding table to {args.output}')
@@ -0,0 +1,104 @@
+"""
+Checks sciebo.extract_folder(), which unpacks zip archives while they download, against archives of every layout its
+parser reads (stored and deflated members, sizes in the header or in a data descriptor, Zip64) and the ones it hands
+over to zipfile, then times it against downloading the archive first and unpacking it afterwards.
+"""
+import argparse
+import io
+import os
+import sys
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from local_http_server import serve
+
+SCIEBO_PATH = Path(__file__).parents[3] / 'intro-to-python-and-pandas' / 'src'  # One of the identical copies of sciebo.py
+
+
+class UnseekableBuffer(io.RawIOBase):
+    """A write-only file that can't seek, so zipfile puts sizes and CRCs in data descriptors after each member, like streaming zip writers do."""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.data += b
+        return len(b)
+
+
+def make_archive(files: dict[str, bytes], compression: int, seekable: bool = True, zip64: bool = False) -> bytes:
+    f = io.BytesIO() if seekable else UnseekableBuffer()
+    with zipfile.ZipFile(f, 'w', compression=compression) as zf:
+        zf.writestr('folder/', b'')
+        for name, data in files.items():
+            with zf.open(zipfile.ZipInfo(name), 'w', force_zip64=zip64) as member:
+                member.write(data)
+    return bytes(f.getvalue() if seekable else f.data)
+
+
+def extracted_files(folder: Path) -> dict[str, bytes]:
+    return {path.relative_to(folder).as_posix(): path.read_bytes() for path in folder.rglob('*') if path.is_file()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sciebo', type=Path, default=SCIEBO_PATH, help='Folder of the sciebo.py to check (default: %(default)s)')
+    parser.add_argument('--size-mb', type=float, default=32, help='Size of the archive that is timed (default: %(default)s)')
+    parser.add_argument('--bandwidth-mb', type=float, default=50, help='Bandwidth of the connection, in MB/s (default: %(default)s)')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp_dir:
+        os.environ['SCIEBO_CACHE_DIR'] = str(Path(tmp_dir) / 'cache')
+        sys.path.insert(0, str(args.sciebo))
+        import sciebo
+
+        files = {
+            'folder/random.bin': os.urandom(300_000),
+            'folder/text.txt': b'trial,response\n' * 50_000,
+            'folder/signature.bin': b'PK\x07\x08' + os.urandom(1000),  # Looks like a data descriptor inside a stored member
+            'folder/empty.txt': b'',
+            'other/notes.txt': b'notes',
+        }
+        archives = {
+            f'{method_name}, {layout}{", Zip64" if zip64 else ""}': make_archive(files, method, seekable=layout == 'sizes in header', zip64=zip64)
+            for method_name, method in [('stored', zipfile.ZIP_STORED), ('deflated', zipfile.ZIP_DEFLATED)]
+            for layout in ['sizes in header', 'data descriptor']
+            for zip64 in [False, True]
+        }
+        archives['bzip2 (unpacked by zipfile after downloading)'] = make_archive(files, zipfile.ZIP_BZIP2)
+        unsafe = make_archive({'../outside.txt': b'outside'}, zipfile.ZIP_DEFLATED)
+
+        served = {f'/{i}/download': data for i, data in enumerate([*archives.values(), unsafe])}
+        with serve(served) as server:
+            for i, name in enumerate(archives):
+                folder = Path(tmp_dir) / f'archive{i}'
+                extracted = sciebo.extract_folder(f'{server.url}/{i}', folder)
+                assert extracted_files(folder) == files, name
+                assert sorted(extracted) == sorted(folder / name for name in files), name
+                selected = sciebo.extract_folder(f'{server.url}/{i}', Path(tmp_dir) / f'selected{i}', members=['other/*'])
+                assert extracted_files(Path(tmp_dir) / f'selected{i}') == {'other/notes.txt': b'notes'} and len(selected) == 1, name
+                print(f'Extracted {name}')
+            try:
+                sciebo.extract_folder(f'{server.url}/{len(archives)}', Path(tmp_dir) / 'unsafe')
+                raise AssertionError('A member outside of the target folder was extracted')
+            except IOError:
+                assert not (Path(tmp_dir) / 'outside.txt').exists()
+                print('Refused a member that would be extracted outside of the target folder')
+
+        big_files = {f'folder/part{i}.bin': os.urandom(int(args.size_mb * 1e6) // 8) for i in range(8)}
+        with serve({'/big/download': make_archive(big_files, zipfile.ZIP_STORED)}, bandwidth=args.bandwidth_mb * 1e6) as server:
+            start = perf_counter()
+            archive = sciebo.download_folder(f'{server.url}/big', Path(tmp_dir) / 'big.zip')
+            with zipfile.ZipFile(archive) as zf:
+                zf.extractall(Path(tmp_dir) / 'big_afterwards')
+            print(f'Download, then unpack: {perf_counter() - start:.2f} s')
+
+            start = perf_counter()
+            sciebo.extract_folder(f'{server.url}/big', Path(tmp_dir) / 'big_streamed')
+            print(f'Unpack while streaming: {perf_counter() - start:.2f} s')
+            assert extracted_files(Path(tmp_dir) / 'big_streamed') == big_files
@@ -0,0 +1,73 @@
+"""Compares storing and using spike_rate as a dense cube against its sparse form (--sparse spike_rate) on a synthetic session."""
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+import xarray as xr
+
+from synthetic_session import SCRIPTS_PATH, load_script, make_session
+
+sys.path.insert(0, str(SCRIPTS_PATH))
+from session_reader import read_categorical
+from spikes import read_sparse
+
+
+def timed(fun, *args, **kwargs):
+    start = perf_counter()
+    result = fun(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def best_time(fun, repeats: int = 3):
+    """Returns the result and fastest of a few runs of fun(); sparse compiles its kernels (with numba) on first use, which this leaves out."""
+    times = []
+    for _ in range(repeats):
+        result, elapsed = timed(fun)
+        times.append(elapsed)
+    return result, min(times)
+
+
+def to_numpy(rate: xr.DataArray) -> np.ndarray:
+    return rate.data.todense() if hasattr(rate.data, 'todense') else rate.values
+
+
+def file_size(path: Path) -> int:
+    return path.stat().st_size if path.is_file() else sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def load_dense(path: Path) -> xr.DataArray:
+    with xr.open_dataset(path) as dset:
+        return dset['spike_rate'].load()
+
+
+def load_sparse(path: Path) -> xr.DataArray:
+    with xr.open_dataset(path) as dset:
+        return read_sparse(dset.load())
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    dd_part, dd_st, dd_wav, dd_lfp = make_session()
+    dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)[['spike_rate', 'brain_area', 'brain_area_code', 'brain_area_categories']]
+    visp = read_categorical(dset, 'brain_area') == 'VISp'
+    print(f"spike_rate: {dset.sizes['cell']} cells x {dset.sizes['trial']} trials x {dset.sizes['time']} bins, "
+          f"{np.count_nonzero(dset['spike_rate'].values) / dset['spike_rate'].size:.1%} non-zero")
+
+    with TemporaryDirectory() as tmp:
+        results = {}
+        for label, sparse_vars, load in [('dense', [], load_dense), ('sparse', ['spike_rate'], load_sparse)]:
+            path = Path(tmp) / f'{label}.nc'
+            _, t_write = timed(convert.write_dataset, dset, path, **convert.STORAGE_SETTINGS, sparse=sparse_vars)
+            rate, t_load = timed(load, path)
+            nbytes = rate.data.nbytes
+            sums, t_sum = best_time(lambda: to_numpy(rate.sum('time')))
+            means, t_mean = best_time(lambda: to_numpy(rate.mean('trial')))
+            area, t_area = best_time(lambda: to_numpy(rate.isel(cell=visp).sum(['cell', 'trial'])))
+            results[label] = sums, means, area
+            print(f'{label:6}  file {file_size(path) / 2 ** 20:6.2f} MB, in memory {nbytes / 2 ** 20:6.1f} MB | write {t_write:6.3f} s, load {t_load:6.3f} s | '
+                  f'sum over time {t_sum:6.3f} s, mean over trials {t_mean:6.3f} s, VISp cells {t_area:6.3f} s')
+
+    for dense, sparse in zip(results['dense'], results['sparse']):
+        assert np.allclose(dense, sparse)
\ No newline at end of file
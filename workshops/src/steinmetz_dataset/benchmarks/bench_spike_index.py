@@ -0,0 +1,39 @@
+"""Compares per-cell and per-trial spike lookups through the spike_offset index against boolean masks over all spikes."""
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from synthetic_session import SCRIPTS_PATH, load_script, make_session
+
+sys.path.insert(0, str(SCRIPTS_PATH))
+from spikes import SpikeIndex
+
+
+def timed(fun, repeats: int = 20) -> float:
+    start = perf_counter()
+    for _ in range(repeats):
+        fun()
+    return (perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    dd_part, dd_st, dd_wav, dd_lfp = make_session()
+    dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)
+    index = SpikeIndex(dset)
+    time, cell, trial = dset['spike_time'].values, dset['spike_cell'].values, dset['spike_trial'].values
+
+    assert np.array_equal(index.cell(11).time, time[cell == 11])
+    assert np.array_equal(index.trial(24).time, time[trial == 24])
+    assert np.array_equal(index.cells_in_trial(24), np.unique(cell[trial == 24]))
+
+    print(f'{len(time):,} spikes, {dset.sizes["cell"]} cells, {dset.sizes["trial"]} trials')
+    queries = {
+        'spikes of cell 11': (lambda: time[cell == 11], lambda: index.cell(11).time),
+        'spikes in trial 24': (lambda: time[trial == 24], lambda: index.trial(24).time),
+        'cells in trial 24': (lambda: np.unique(cell[trial == 24]), lambda: index.cells_in_trial(24)),
+    }
+    for name, (masked, indexed) in queries.items():
+        t_mask, t_index = timed(masked), timed(indexed)
+        print(f'{name:20} mask: {t_mask * 1e3:8.3f} ms   index: {t_index * 1e3:8.3f} ms  ({t_mask / t_index:.0f}x faster)')
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""Compares the vectorized spike-event flattening against the original nested-loop version on a synthetic session."""
+from time import perf_counter
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from synthetic_session import load_script, make_session
+
+
+def nested_loop_spiketimes_dataframe(dd_st: dict[str, Any]) -> pd.DataFrame:
+    """The original implementation, kept here as the reference output."""
+    spike_times = np.concatenate((dd_st['ss'], dd_st['ss_passive']), axis=1)
+
+    rows = []
+    for neuron_id, neuron_data in enumerate(spike_times, start=1):
+        for trial_id, trial_data in enumerate(neuron_data, start=1):
+            for spike_time in trial_data:
+                rows.append([neuron_id, trial_id, spike_time])
+
+    df = pd.DataFrame(rows, columns=['Cell', 'Trial', 'SpikeTime'])
+    df = df.astype({'Trial': np.uint32, 'Cell': np.uint32})
+    return df
+
+
+def timed(fun, *args, **kwargs):
+    start = perf_counter()
+    result = fun(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    _, dd_st, _, _ = make_session()
+
+    df_loop, t_loop = timed(nested_loop_spiketimes_dataframe, dd_st=dd_st)
+    df_vec, t_vec = timed(convert.steinmetz_to_spiketimes_dataframe, dd_st=dd_st)
+
+    assert df_vec.columns.tolist() == df_loop.columns.tolist()
+    assert (df_vec['Cell'].values == df_loop['Cell'].values).all()
+    assert (df_vec['Trial'].values == df_loop['Trial'].values).all()
+    assert np.array_equal(df_vec['SpikeTime'].values, df_loop['SpikeTime'].values.astype(np.float32))
+
+    print(f'{len(df_vec):,} spikes')
+    print(f'nested loops: {t_loop:7.3f} s')
+    print(f'vectorized:   {t_vec:7.3f} s  ({t_loop / t_vec:.0f}x faster)')
@@ -0,0 +1,67 @@
+"""Compares write time, size on disk and common read patterns of the converter's storage backends and compressors."""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pandas as pd
+import xarray as xr
+
+from synthetic_session import load_script, make_session
+
+
+def disk_size(path: Path) -> int:
+    return path.stat().st_size if path.is_file() else sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+def time_read(path: Path, read) -> float:
+    start = perf_counter()
+    with xr.open_dataset(path) as dset:
+        read(dset)
+    return perf_counter() - start
+
+
+READ_PATTERNS = {
+    'one cell spike_rate': lambda dset: dset['spike_rate'].sel(cell=11).values,
+    'one trial lfp': lambda dset: dset['lfp'].sel(trial=24).values,
+    'one trial all cells': lambda dset: dset['spike_rate'].sel(trial=24).values,
+    'trial table': lambda dset: dset[['contrast_left', 'contrast_right', 'gocue', 'response_type', 'feedback_type']].to_dataframe(),
+}
+
+CONFIGURATIONS = [
+    ('netcdf', 'zlib', 5),
+    ('netcdf', 'zstd', 3),
+    ('zarr', 'zlib', 5),
+    ('zarr', 'zstd', 3),
+    ('zarr', 'blosc', 5),
+    ('zarr', 'lz4', 1),
+]
+
+
+if __name__ == '__main__':
+    convert = load_script('2_convert_to_netcdf')
+    dd_part, dd_st, dd_wav, dd_lfp = make_session()
+    dset = convert.steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)
+
+    rows = []
+    with TemporaryDirectory() as tmp_dir:
+        for backend, compressor, complevel in CONFIGURATIONS:
+            path = Path(tmp_dir) / f'{backend}_{compressor}{convert.BACKEND_SUFFIXES[backend]}'
+            start = perf_counter()
+            try:
+                convert.write_dataset(dset, path=path, backend=backend, compressor=compressor, complevel=complevel)
+            except (ImportError, RuntimeError) as error:  # e.g. zarr not installed, or zstd missing from the HDF5 plugins
+                print(f'Skipping {backend}/{compressor}: {error!r}')
+                continue
+            row = {
+                'backend': backend,
+                'compressor': compressor,
+                'complevel': complevel,
+                'write (s)': perf_counter() - start,
+                'size (MB)': disk_size(path) / 1e6,
+            }
+            for name, read in READ_PATTERNS.items():
+                row[f'{name} (ms)'] = 1000 * time_read(path, read)
+            rows.append(row)
+
+    print(f'Uncompressed size: {dset.nbytes / 1e6:.0f} MB')
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
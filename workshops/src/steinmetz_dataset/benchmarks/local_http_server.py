@@ -0,0 +1,103 @@
+"""A local stand-in for the file servers the download scripts talk to, with Range support and adjustable latency and bandwidth."""
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+
+class FileServer(ThreadingHTTPServer):
+    """
+    Serves files from memory: files maps each URL path (e.g. '/agvxh/download') to its contents.
+    Every response waits `latency` seconds and is sent at up to `bandwidth` bytes/s per connection;
+    with cut_after set, responses stop after that many bytes, like an interrupted connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files: dict[str, bytes], latency: float = 0., bandwidth: float = float('inf'), cut_after: Optional[int] = None) -> None:
+        super().__init__(('127.0.0.1', 0), FileRequestHandler)
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.cut_after = cut_after
+        self.requests: list[tuple[str, dict[str, str]]] = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    server: FileServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.respond(send_body=False)
+
+    def do_GET(self) -> None:
+        self.respond(send_body=True)
+
+    def respond(self, send_body: bool) -> None:
+        self.server.requests.append((self.path, dict(self.headers)))
+        time.sleep(self.server.latency)
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        data = self.server.files[self.path]
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start, stop, status = 0, len(data), 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match[1] or 0)
+            stop = min(int(match[2]) + 1, len(data)) if match[2] else len(data)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{stop - 1}/{len(data)}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        end = stop if self.server.cut_after is None else min(stop, start + self.server.cut_after)
+        block = 2 ** 16
+        for offset in range(start, end, block):
+            chunk = data[offset:min(offset + block, end)]
+            self.wfile.write(chunk)
+            if self.server.bandwidth != float('inf'):
+                time.sleep(len(chunk) / self.server.bandwidth)
+        if end < stop:
+            self.close_connection = True
+
+
+@contextmanager
+def serve(files: dict[str, bytes], **options) -> Iterator[FileServer]:
+    """Runs a FileServer in a background thread for the duration of the with block."""
+    server = FileServer(files, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
\ No newline at end of file
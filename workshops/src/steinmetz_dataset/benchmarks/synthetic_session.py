@@ -0,0 +1,90 @@
+"""Synthetic Steinmetz sessions, shaped like the Neuromatch Academy NPZ records, for benchmarking the pipeline scripts."""
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import numpy as np
+
+SCRIPTS_PATH = Path(__file__).parent.parent / 'scripts'
+
+
+def load_script(name: str) -> ModuleType:
+    """Imports one of the numbered pipeline scripts (e.g. '2_convert_to_netcdf') without running its __main__ block."""
+    spec = spec_from_file_location(name.lstrip('0123456789_'), SCRIPTS_PATH / f'{name}.py')
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_session(
+    n_cells: int = 700,
+    n_active: int = 250,
+    n_passive: int = 90,
+    n_time: int = 250,
+    mean_rate: float = 4.,
+    seed: int = 0,
+) -> tuple[dict[str, Any], dict[str, Any], dict[str, Any], dict[str, Any]]:
+    """Returns (dd_part, dd_st, dd_wav, dd_lfp) records for one session of realistic size."""
+    rng = np.random.default_rng(seed)
+    n_trials = n_active + n_passive
+    bin_size = 0.01
+    duration = n_time * bin_size
+
+    rates = rng.gamma(shape=1., scale=mean_rate, size=n_cells)
+    spike_counts = rng.poisson(rates[:, None] * duration, size=(n_cells, n_trials))
+    ss = np.empty((n_cells, n_trials), dtype=object)
+    spks = np.zeros((n_cells, n_trials, n_time), dtype=np.float64)
+    for (cell, trial), count in np.ndenumerate(spike_counts):
+        times = np.sort(rng.uniform(0, duration, size=count))
+        ss[cell, trial] = times
+        np.add.at(spks[cell, trial], np.minimum((times / bin_size).astype(int), n_time - 1), 1)
+
+    areas = np.array(['VISp', 'CA1', 'MOs', 'LGd', 'root', 'SCm', 'CP'])
+    lfp_areas = areas[:4]
+    contrasts = np.array([0., .25, .5, 1.])
+
+    dd_part = {
+        'mouse_name': 'Synthetic',
+        'date_exp': '2017-01-01',
+        'bin_size': bin_size,
+        'stim_onset': .5,
+        'ccf_axes': np.array(['ap', 'dv', 'lr']),
+        'spks': spks[:, :n_active],
+        'spks_passive': spks[:, n_active:],
+        'wheel': rng.integers(-3, 4, size=(1, n_active, n_time)).astype(np.float64),
+        'wheel_passive': rng.integers(-3, 4, size=(1, n_passive, n_time)).astype(np.float64),
+        'licks': rng.binomial(1, .01, size=(1, n_active, n_time)).astype(np.float64),
+        'licks_passive': rng.binomial(1, .01, size=(1, n_passive, n_time)).astype(np.float64),
+        'pupil': rng.normal(size=(3, n_active, n_time)),
+        'pupil_passive': rng.normal(size=(3, n_passive, n_time)),
+        'face': rng.normal(size=(1, n_active, n_time)),
+        'face_passive': rng.normal(size=(1, n_passive, n_time)),
+        'contrast_left': rng.choice(contrasts, size=n_active),
+        'contrast_right': rng.choice(contrasts, size=n_active),
+        'contrast_left_passive': rng.choice(contrasts, size=n_passive),
+        'contrast_right_passive': rng.choice(contrasts, size=n_passive),
+        'gocue': rng.uniform(.8, 1.2, size=(n_active, 1)),
+        'response': rng.choice([-1., 0., 1.], size=n_active),
+        'response_time': rng.uniform(1., 2., size=(n_active, 1)),
+        'feedback_type': rng.choice([-1., 1.], size=n_active),
+        'feedback_time': rng.uniform(1., 2.5, size=(n_active, 1)),
+        'reaction_time': np.column_stack((rng.uniform(100, 500, size=n_active), rng.choice([-1., 0., 1.], size=n_active))),
+        'prev_reward': rng.uniform(0, 1, size=(n_active, 1)),
+        'active_trials': np.arange(n_trials) < n_active,
+        'brain_area': rng.choice(areas, size=n_cells),
+        'ccf': rng.normal(scale=1000., size=(n_cells, 3)),
+        'trough_to_peak': rng.integers(5, 25, size=n_cells).astype(np.float64),
+        'cellid_orig': np.ones(n_cells, dtype=np.int64),
+    }
+    dd_st = {'ss': ss[:, :n_active], 'ss_passive': ss[:, n_active:]}
+    dd_wav = {
+        'waveform_w': rng.normal(size=(n_cells, 82, 3)),
+        'waveform_u': rng.normal(size=(n_cells, 3, 384)),
+    }
+    dd_lfp = {
+        'brain_area_lfp': list(lfp_areas),
+        'lfp': rng.normal(scale=10., size=(len(lfp_areas), n_active, n_time)),
+        'lfp_passive': rng.normal(scale=10., size=(len(lfp_areas), n_passive, n_time)),
+    }
+    return dd_part, dd_st, dd_wav, dd_lfp
@@ -1,22 +1,155 @@
+import argparse
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import NamedTuple, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+
+class Download(NamedTuple):
+    url: str
+    subdir: str
+    fname: str
+
+
 urls = [
-  ("https://osf.io/agvxh/download", "neuropixels", "steinmetz_part0.npz"),
-  ("https://osf.io/uv3mw/download", "neuropixels", "steinmetz_part1.npz"),
-  ("https://osf.io/ehmw2/download", "neuropixels", "steinmetz_part2.npz"),
-  ("https://osf.io/4bjns/download", "lfp", "steinmetz_st.npz"),
-  ("https://osf.io/ugm9v/download", "lfp", "steinmetz_wav.npz"),
-  ("https://osf.io/kx3v9/download", "lfp", "steinmetz_lfp.npz"),
+  Download("https://osf.io/agvxh/download", "neuropixels", "steinmetz_part0.npz"),
+  Download("https://osf.io/uv3mw/download", "neuropixels", "steinmetz_part1.npz"),
+  Download("https://osf.io/ehmw2/download", "neuropixels", "steinmetz_part2.npz"),
+  Download("https://osf.io/4bjns/download", "lfp", "steinmetz_st.npz"),
+  Download("https://osf.io/ugm9v/download", "lfp", "steinmetz_wav.npz"),
+  Download("https://osf.io/kx3v9/download", "lfp", "steinmetz_lfp.npz"),
 ]
 
-base_path = Path("data/raw")
+CHUNK_SIZE = 2 ** 20  # Bytes written to disk at a time
+TIMEOUT = (10, 60)  # Seconds to wait for the connection, and between received bytes
+ATTEMPTS = 5  # Times an interrupted download is resumed before giving up
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 23), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_session(workers: int) -> requests.Session:
+    """Returns a requests Session whose connection pool is large enough for `workers` concurrent downloads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=3)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download_file(session: requests.Session, url: str, path: Path, timeout=TIMEOUT, position: Optional[int] = None) -> Path:
+    """
+    Streams url to path in chunks.  Data is written to a '.part' file first, which is renamed once complete;
+    if a '.part' file is left over from an interrupted run, only the missing bytes are requested (HTTP Range).
+    """
+    part_path = path.with_name(path.name + '.part')
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 416:  # Range Not Satisfiable: the '.part' file already holds the whole file
+            part_path.replace(path)
+            return path
+        r.raise_for_status()
+        if r.status_code != 206:  # The server ignored the Range header and is sending the whole file again
+            offset = 0
+        total = int(r.headers['Content-Length']) + offset if 'Content-Length' in r.headers else None
+        with open(part_path, 'ab' if offset else 'wb') as f, tqdm(desc=path.name, total=total, initial=offset, unit='B', unit_scale=True, position=position, leave=False) as progress:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                progress.update(len(chunk))
+    if total is not None and part_path.stat().st_size != total:
+        raise IOError(f"Download of {url} ended after {part_path.stat().st_size} of {total} bytes. Run again to resume it.")
+    part_path.replace(path)
+    return path
+
+
+class ChecksumManifest:
+    """
+    A JSON file of the sha256 checksum of each downloaded file.  Files without an entry are recorded when first
+    downloaded; files with an entry are verified against it, so the manifest can be shared to check other copies of the data.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.checksums: dict[str, str] = json.loads(path.read_text()) if path.exists() else {}
+
+    def verify(self, fname: str, path: Path) -> bool:
+        """Returns whether path matches the recorded checksum of fname, recording it if fname has no entry yet."""
+        checksum = file_checksum(path)
+        expected = self.checksums.setdefault(fname, checksum)
+        return checksum == expected
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.checksums, indent=2, sort_keys=True))
+        tmp_path.replace(self.path)
+
+
+def fetch(session: requests.Session, download: Download, base_path: Path, manifest: ChecksumManifest, timeout=TIMEOUT, position: Optional[int] = None) -> Path:
+    """
+    Downloads one file, unless a verified copy already exists, resuming it if the connection breaks,
+    and checks the result against the manifest.
+    """
+    path = base_path / download.subdir / download.fname
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists() and download.fname in manifest.checksums and manifest.verify(download.fname, path):
+        return path
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            download_file(session, download.url, path, timeout=timeout, position=position)
+            break
+        except requests.HTTPError:
+            raise
+        except IOError:  # Broken connections and timeouts; requests' exceptions are IOErrors too
+            if attempt == ATTEMPTS:
+                raise
+    if not manifest.verify(download.fname, path):
+        path.unlink()
+        raise IOError(f"Checksum of {download.fname} does not match the manifest; the file was deleted. Run again to download it anew.")
+    return path
+
+
+def download_all(downloads: list[Download], base_path: Path, manifest_path: Path, workers: int = 6, timeout=TIMEOUT) -> list[str]:
+    """
+    Downloads all files concurrently over one shared connection pool.  A failing download doesn't stop the
+    others; the error messages of all failed downloads are returned.
+    """
+    manifest = ChecksumManifest(manifest_path)
+    errors = []
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch, session, download, base_path, manifest, timeout=timeout, position=position): download
+            for position, download in enumerate(downloads, start=1)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading Raw NPZ Files", unit='file', position=0):
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(f"{futures[future].fname}: {error!r}")
+    manifest.save()
+    return errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Download the raw Steinmetz NPZ files from the Neuromatch Academy archive on OSF.')
+    parser.add_argument('--workers', type=int, default=len(urls), help='Number of files to download at the same time (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT[1], help='Seconds without data after which a download is aborted (default: %(default)s)')
+    parser.add_argument('--manifest', type=Path, default=Path('data/raw/checksums.json'), help='JSON file of the files\' sha256 checksums (default: %(default)s)')
+    args = parser.parse_args()
 
-for url, subdir, fname in tqdm(urls):
-    path: Path = base_path / subdir / fname
-    path.parent.mkdir(parents=True, exist_ok=True)  
-    r = requests.get(url)
-    r.raise_for_status()
-    path.write_bytes(r.content)
+    base_path = Path("data/raw")
+    errors = download_all(urls, base_path=base_path, manifest_path=args.manifest, workers=args.workers, timeout=(TIMEOUT[0], args.timeout))
+    if errors:
+        raise IOError(f"{len(errors)} file(s) could not be downloaded:\n" + "\n".join(errors))
\ No newline at end of file
@@ -1,6 +1,13 @@
+import argparse
+import hashlib
+import json
+import pickle
+import sys
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
 from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
 from warnings import warn
 import numpy as np
 import pandas as pd
@@ -8,6 +15,20 @@ from tqdm import tqdm
 from xarray import DataArray, Dataset, Coordinates
 
 
+# Bump whenever the contents of the written files change, so that existing outputs get rebuilt.
+CONVERTER_VERSION = 8
+
+# Storage settings for each variable. Compression is slower to write, but shrunk data to 6% the original size!
+# Per-variable overrides of the compressor, complevel and shuffle settings can be given in the 'variables' entry.
+STORAGE_SETTINGS = {'backend': 'netcdf', 'compressor': 'zlib', 'complevel': 5, 'shuffle': True}
+BACKEND_SUFFIXES = {'netcdf': '.nc', 'zarr': '.zarr'}
+COMPRESSORS = ['zlib', 'zstd', 'blosc', 'lz4']
+CHUNK_BYTES = 2 ** 17  # Target (uncompressed) size of each chunk
+FLOAT32_RTOL = 1e-6  # Largest relative error accepted when storing float64 data as float32
+DTYPE_SCAN_BLOCK = 2 ** 20  # Number of values checked at a time when planning dtypes
+CATALOG_COLUMNS = ['mouse', 'session_date', 'n_cells', 'n_trials', 'n_active_trials', 'brain_areas', 'brain_groups', 'path', 'size', 'sha256']
+
+
 @lru_cache
 def get_brain_group_dict() -> dict[str, str]:
     brain_groups = {}
@@ -28,11 +49,33 @@ def get_brain_group_dict() -> dict[str, str]:
     return brain_groups
 
 
+def label_brain_groups(brain_areas: np.ndarray) -> np.ndarray:
+    """Returns the brain group of each area (or the area itself, if it belongs to no group), looking up each distinct area only once."""
+    codes, areas = pd.factorize(np.asarray(brain_areas, dtype=object))
+    groups = np.array([get_brain_group_dict().get(area, area) for area in areas], dtype=str)
+    return groups[codes]
+
+
+def categorical_variables(name: str, values: np.ndarray, dim: str) -> dict[str, DataArray]:
+    """
+    Returns string values as variable name (along dim), next to their integer codes (variable <name>_code) into a sorted
+    table of their distinct values (variable <name>_categories), which can be compared and grouped as numbers.
+    session_reader.read_categorical() turns the codes back into a pandas Categorical.
+    """
+    codes, categories = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return {
+        name: DataArray(data=np.asarray(values, dtype=str), dims=(dim,)),
+        f'{name}_code': DataArray(data=codes, dims=(dim,), attrs={'categories': f'{name}_categories'}),
+        f'{name}_categories': DataArray(data=np.asarray(categories, dtype=str), dims=(f'{name}_category',)),
+    }
+
 
-def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp: dict[str, Any], dd_st: dict[str, Any]) -> Dataset:
+def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp: dict[str, Any], dd_st: dict[str, Any], compact: bool = True) -> Dataset:
+    """Builds one session's Dataset; if compact, each variable is stored in the smallest dtype that holds its values (see compact_dtypes())."""
     assert list(dd_part['ccf_axes']) == ['ap', 'dv', 'lr']
 
     spike_events_df = steinmetz_to_spiketimes_dataframe(dd_st=dd_st)
+    n_cells, n_trials = dd_part['spks'].shape[0], dd_part['active_trials'].shape[0]
 
     dset = Dataset(
         dict(
@@ -40,13 +83,13 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
             contrast_left = DataArray(
                 data=(np.concatenate(
                     (dd_part['contrast_left'], dd_part['contrast_left_passive']),
-                ) * 100).astype(np.int8),
+                ) * 100),
                 dims=('trial',)
             ),
             contrast_right = DataArray(
                 data=(np.concatenate(
                     (dd_part['contrast_right'], dd_part['contrast_right_passive']),
-                ) * 100).astype(np.int8),
+                ) * 100),
                 dims=('trial',)
             ),
             gocue = DataArray(
@@ -92,7 +135,7 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
                 data=np.concatenate(
                     (dd_part['wheel'].squeeze(), dd_part['wheel_passive'].squeeze()), 
                     axis=0,
-                ).astype(np.int8),
+                ),
                 dims=('trial', 'time')
             ),
 
@@ -101,7 +144,7 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
                 data=np.concatenate(
                     (dd_part['licks'].squeeze(), dd_part['licks_passive'].squeeze()),
                     axis=0,
-                ).astype(np.int8),
+                ),
                 dims=('trial', 'time'),
             ),
 
@@ -142,20 +185,16 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
                 data=np.concatenate(
                     (dd_part['spks'], dd_part['spks_passive']),
                     axis=1,
-                ).astype(np.int8), 
+                ), 
                 dims=('cell', 'trial', 'time')
             ),
 
-            trough_to_peak = DataArray(data=dd_part['trough_to_peak'].astype(np.int8), dims=('cell',)),
+            trough_to_peak = DataArray(data=dd_part['trough_to_peak'], dims=('cell',)),
             ccf_ap = DataArray(data=dd_part['ccf'][:, 0], dims=('cell',)),
             ccf_dv = DataArray(data=dd_part['ccf'][:, 1], dims=('cell',)),
             ccf_lr = DataArray(data=dd_part['ccf'][:, 2], dims=('cell',)),
-            brain_area = DataArray(data=dd_part['brain_area'], dims=('cell',)),
-            
-            brain_groups = DataArray(
-                data=[get_brain_group_dict().get(area, area) for area in dd_part['brain_area']],
-                dims=('cell',)
-            ),
+            **categorical_variables('brain_area', dd_part['brain_area'], dim='cell'),
+            **categorical_variables('brain_groups', label_brain_groups(dd_part['brain_area']), dim='cell'),
 
             # Waveform data
             waveform_w = DataArray(
@@ -188,6 +227,11 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
                 data=spike_events_df['Trial'].values,
                 dims=('spike_id',)
             ),
+            # Position of each cell's and trial's first spike in the arrays above, which are sorted by cell, then trial
+            spike_offset = DataArray(
+                data=spike_offsets(spike_events_df['Cell'].values, spike_events_df['Trial'].values, n_cells=n_cells, n_trials=n_trials),
+                dims=('cell', 'trial'),
+            ),
             
         ),
         coords=Coordinates({
@@ -210,62 +254,547 @@ def steinmetz_to_xarray(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp:
     #     'mouse': [dd_part['mouse_name']],
     #     'session_date': [dd_part['date_exp']],
     # })
+    if compact:
+        dset, _ = compact_dtypes(dset)
+    return dset
+
+
+def _value_range(values: np.ndarray) -> dict[str, Any]:
+    """Scans values in blocks (to avoid full-size temporary copies) for their finite range, and whether they are all finite, all whole numbers, and exactly enough representable as float32."""
+    stats = {'min': None, 'max': None, 'all_finite': True, 'integral': True, 'float32_ok': True}
+    flat = values.reshape(-1)
+    for start in range(0, flat.size, DTYPE_SCAN_BLOCK):
+        block = flat[start:start + DTYPE_SCAN_BLOCK]
+        if values.dtype.kind == 'f':
+            finite = np.isfinite(block)
+            if not finite.all():
+                stats['all_finite'] = False
+                block = block[finite]
+            if not block.size:
+                continue
+            stats['integral'] = stats['integral'] and bool(np.all(block == np.round(block)))
+            if stats['float32_ok'] and values.dtype.itemsize > 4:
+                with np.errstate(over='ignore'):
+                    as_float32 = block.astype(np.float32)
+                stats['float32_ok'] = bool(np.isfinite(as_float32).all() and np.allclose(as_float32, block, rtol=FLOAT32_RTOL, atol=0))
+        lo, hi = block.min(), block.max()
+        stats['min'] = lo if stats['min'] is None else min(stats['min'], lo)
+        stats['max'] = hi if stats['max'] is None else max(stats['max'], hi)
+    return stats
+
+
+def plan_dtype(values: np.ndarray) -> np.dtype:
+    """
+    Returns the smallest dtype that holds all of values without overflow or loss of precision:
+    whole numbers get the smallest integer type (unsigned only if they already were), other floats
+    get float32 if that keeps them within FLOAT32_RTOL, and everything else keeps its dtype.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iuf' or not values.size:
+        return values.dtype
+
+    stats = _value_range(values)
+    if stats['min'] is None:  # all NaN
+        return np.dtype(np.float32)
+    if stats['all_finite'] and stats['integral']:
+        int_types = [np.uint8, np.uint16, np.uint32, np.uint64] if values.dtype.kind == 'u' else [np.int8, np.int16, np.int32, np.int64]
+        for int_type in int_types:
+            if np.iinfo(int_type).min <= stats['min'] and stats['max'] <= np.iinfo(int_type).max:
+                return np.dtype(int_type)
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4 and stats['float32_ok']:
+        return np.dtype(np.float32)
+    return values.dtype
+
+
+def safe_cast(values: np.ndarray, dtype: np.dtype, name: str = 'values') -> np.ndarray:
+    """Like values.astype(dtype), but raises an OverflowError instead of silently wrapping values that don't fit."""
+    dtype = np.dtype(dtype)
+    if dtype == values.dtype or not values.size:
+        return values.astype(dtype)
+    stats = _value_range(values)
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        if not stats['all_finite'] or stats['min'] is None:
+            raise OverflowError(f"{name} contains NaN or infinite values, which can't be cast to {dtype}.")
+        if stats['min'] < info.min or stats['max'] > info.max:
+            raise OverflowError(f"{name} has values from {stats['min']} to {stats['max']}, which don't fit in {dtype}.")
+    elif dtype.kind == 'f' and stats['min'] is not None:
+        info = np.finfo(dtype)
+        if stats['min'] < info.min or stats['max'] > info.max:
+            raise OverflowError(f"{name} has values from {stats['min']} to {stats['max']}, which don't fit in {dtype}.")
+    return values.astype(dtype)
+
+
+def compact_dtypes(dset: Dataset) -> tuple[Dataset, pd.DataFrame]:
+    """Casts every data variable to the dtype chosen by plan_dtype(), returning the new Dataset and a table of the memory saved per variable."""
+    dset = dset.copy()
+    rows = []
+    for name in list(dset.data_vars):
+        var = dset[name]
+        dtype = plan_dtype(var.values)
+        rows.append({
+            'variable': name,
+            'dtype_before': str(var.dtype),
+            'dtype_after': str(dtype),
+            'nbytes_before': var.nbytes,
+            'nbytes_after': var.size * dtype.itemsize,
+        })
+        if dtype != var.dtype:
+            dset[name] = var.copy(data=safe_cast(var.values, dtype, name=name))
+    return dset, pd.DataFrame(rows).set_index('variable')
+
+
+def sparsify_variables(dset: Dataset, names: Iterable[str]) -> Dataset:
+    """
+    Replaces each of the named variables by its non-zero values in C order (<name>_value) and their flat positions
+    (<name>_index), along a <name>_nonzero dimension.  The index records the variable's dims, from which
+    spikes.read_sparse() rebuilds it as a sparse array without ever holding it densely.
+    """
+    dset = dset.copy()
+    for name in names:
+        var = dset[name]
+        values = var.values.reshape(-1)
+        index = np.flatnonzero(values)
+        nonzero_dim = f'{name}_nonzero'
+        dset[f'{name}_index'] = DataArray(safe_cast(index, plan_dtype(index), name=f'{name}_index'), dims=(nonzero_dim,), attrs={'sparse_dims': ' '.join(var.dims)})
+        dset[f'{name}_value'] = DataArray(values[index], dims=(nonzero_dim,), attrs=var.attrs)
+        dset = dset.drop_vars(name)
     return dset
 
 
 def steinmetz_to_spiketimes_dataframe(dd_st: dict[str, Any]) -> pd.DataFrame:
     spike_times = np.concatenate((dd_st['ss'], dd_st['ss_passive']), axis=1)
-    
-    rows = []
-    for neuron_id, neuron_data in enumerate(spike_times, start=1):
-        for trial_id, trial_data in enumerate(neuron_data, start=1):
-            for spike_time in trial_data:
-                rows.append([neuron_id, trial_id, spike_time])
+    n_cells, n_trials = spike_times.shape
+
+    # Each (cell, trial) entry holds a ragged array of spike times; flatten them cell-major, trial-minor
+    spike_trains = spike_times.ravel()
+    n_spikes = np.fromiter(map(len, spike_trains), dtype=np.intp, count=spike_trains.size)
+
+    cells = np.repeat(np.repeat(np.arange(1, n_cells + 1, dtype=np.uint32), n_trials), n_spikes)
+    trials = np.repeat(np.tile(np.arange(1, n_trials + 1, dtype=np.uint32), n_cells), n_spikes)
+    times = np.empty(n_spikes.sum(), dtype=np.float32)
+    if len(times):
+        np.concatenate(spike_trains, out=times, casting='same_kind')
 
-    df = pd.DataFrame(rows, columns=['Cell', 'Trial', 'SpikeTime'])
-    df = df.astype({'Trial': np.uint32, 'Cell': np.uint32})
+    df = pd.DataFrame({'Cell': cells, 'Trial': trials, 'SpikeTime': times})
     return df
 
 
+def spike_offsets(cells: np.ndarray, trials: np.ndarray, n_cells: int, n_trials: int) -> np.ndarray:
+    """
+    Returns the (n_cells, n_trials) index of the first spike of each cell and trial into spike arrays sorted by cell, then trial.
+    Read in that order and followed by the number of spikes, the offsets bound each (cell, trial) block of spikes, as in a CSR
+    sparse matrix (see spikes.SpikeIndex).  cells and trials are numbered from 1, as in the Dataset.
+    """
+    keys = (cells.astype(np.intp) - 1) * n_trials + (trials.astype(np.intp) - 1)
+    if np.any(keys[1:] < keys[:-1]):
+        raise ValueError("Spikes must be sorted by cell, then trial.")
+    counts = np.bincount(keys, minlength=n_cells * n_trials)
+    offsets = np.zeros(n_cells * n_trials, dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    return offsets.reshape(n_cells, n_trials)
 
-if __name__ == '__main__':
 
-    base_path = Path('data/processed')
-    base_path.mkdir(parents=True, exist_ok=True)
+def chunk_shape(var: DataArray, target_bytes: int = CHUNK_BYTES) -> tuple[int, ...]:
+    """
+    Chunks a variable along its cell and trial dimensions (or else its spike_id or first dimension), keeping all
+    other dimensions whole.  Where a variable has both, each chunk covers about as many cells as trials
+    (about the square root of the number that fit in target_bytes), so that reading one cell's data and reading
+    one trial's data across all cells both only decompress a small part of the variable.
+    """
+    split_dims = [dim for dim in ['cell', 'trial'] if dim in var.dims] or [next((dim for dim in ['spike_id'] if dim in var.dims), var.dims[0])]
+    slice_bytes = var.dtype.itemsize * int(np.prod([size for dim, size in var.sizes.items() if dim not in split_dims]))
+    budget = max(1, target_bytes // max(slice_bytes, 1))  # Number of (cell, trial) slices per chunk
 
-    print('Reading Spike Times File...', end='', flush=True)
-    dat_st = iter(np.load('data/raw/lfp/steinmetz_st.npz', allow_pickle=True)['dat'])
-    print(f'..done.', flush=True)
+    # Share the budget evenly, giving what a short dimension can't use to the remaining ones
+    chunks = {}
+    ordered = sorted(split_dims, key=lambda dim: var.sizes[dim])
+    for idx, dim in enumerate(ordered):
+        chunks[dim] = max(1, min(var.sizes[dim], int(budget ** (1 / (len(ordered) - idx)))))
+        budget = max(1, budget // chunks[dim])
+    return tuple(chunks.get(dim, size) for dim, size in var.sizes.items())
 
-    print('Reading Spike Waveform Data...', end='', flush=True)
-    dat_wav = iter(np.load('data/raw/lfp/steinmetz_wav.npz', allow_pickle=True)['dat'])
-    print(f'..done.', flush=True)
 
-    print('Reading LFP Data...', end='', flush=True)
-    dat_lfp = iter(np.load('data/raw/lfp/steinmetz_lfp.npz', allow_pickle=True)['dat'])
-    print(f'..done.', flush=True)
+def netcdf_compression(compressor: str, complevel: int, shuffle: bool = True) -> dict[str, Any]:
+    if compressor == 'zlib':
+        return {'zlib': True, 'complevel': complevel, 'shuffle': shuffle}
+    if compressor == 'zstd':
+        return {'compression': 'zstd', 'complevel': complevel, 'shuffle': shuffle}
+    # The HDF5 blosc filter fails on chunks it can't compress (e.g. noisy lfp), so blosc and lz4 are left to Zarr.
+    raise ValueError(f"Compressor {compressor!r} is not available for NetCDF files. Choose zlib or zstd, or use the zarr backend.")
 
-    paths = [Path(f'data/raw/neuropixels/steinmetz_part{i}.npz') for i in [0, 1, 2]]
-    for path in tqdm(paths, desc="Reading Raw NPZ Files"):
-        dat = np.load(path, allow_pickle=True)['dat']
 
-        for dd, dd_st, dd_wav, dd_lfp in tqdm(list(zip(dat, dat_st, dat_wav, dat_lfp)), desc=f"Writing Processed NetCDF Files from {path.name}"):
+def zarr_compression(compressor: str, complevel: int, shuffle: bool = True, itemsize: int = 1) -> dict[str, Any]:
+    import numcodecs
 
-            # Verify that the sessions in different files match, using cell counts
-            if dd_wav['waveform_w'].shape[0] != dd['cellid_orig'].sum():
-                raise IOError(f"Problem at {dd['date_exp'], dd['mouse_name']}.  Reason: has a different number of cells in the partx.npx and extra.npx data files")
+    filters = [numcodecs.Shuffle(elementsize=itemsize)] if shuffle and itemsize > 1 and compressor != 'blosc' else []
+    if compressor == 'zlib':
+        return {'filters': filters, 'compressors': [numcodecs.Zlib(level=complevel)]}
+    if compressor == 'zstd':
+        return {'filters': filters, 'compressors': [numcodecs.Zstd(level=complevel)]}
+    if compressor == 'blosc':
+        blosc_shuffle = numcodecs.Blosc.SHUFFLE if shuffle else numcodecs.Blosc.NOSHUFFLE
+        return {'filters': filters, 'compressors': [numcodecs.Blosc(cname='lz4', clevel=complevel, shuffle=blosc_shuffle)]}
+    if compressor == 'lz4':
+        return {'filters': filters, 'compressors': [numcodecs.LZ4()]}
+    raise ValueError(f"Compressor {compressor!r} is not available for Zarr stores. Choose one of: {', '.join(COMPRESSORS)}.")
 
 
-            # Make xarray Dataset for most data, save to compressed NetCDF file.
-            dset = steinmetz_to_xarray(dd_part=dd, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)            
-            settings = {'zlib': True, 'complevel': 5}  # Compression settings for each variable. Slower to write, but shrunk data to 6% the original size!
-            encodings = {var: settings for var in dset.data_vars if not 'U' in str(dset[var].dtype)}
-            
-            session_path = base_path / f'steinmetz_{dd["date_exp"]}_{dd["mouse_name"]}.nc'
-            session_path.parent.mkdir(parents=True, exist_ok=True)
-            dset.to_netcdf(
-                path=session_path,
-                format="NETCDF4",
-                engine="netcdf4",
-                encoding=encodings,   
-            )
\ No newline at end of file
+def compression_encoding(backend: str, compressor: str, complevel: int, shuffle: bool = True, itemsize: int = 1) -> dict[str, Any]:
+    if backend == 'netcdf':
+        return netcdf_compression(compressor, complevel, shuffle=shuffle)
+    if backend == 'zarr':
+        return zarr_compression(compressor, complevel, shuffle=shuffle, itemsize=itemsize)
+    raise ValueError(f"Unknown storage backend {backend!r}. Choose one of: {', '.join(BACKEND_SUFFIXES)}.")
+
+
+def make_encoding(
+    dset: Dataset,
+    backend: str,
+    compressor: str,
+    complevel: int,
+    shuffle: bool = True,
+    variables: Optional[dict[str, dict[str, Any]]] = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Returns the chunking and compression encoding of every variable, for the given storage backend.  String variables
+    (e.g. brain_area) are stored in NetCDF files as fixed-width character arrays, because HDF5 can't compress
+    variable-length strings.
+    variables can override the compressor, complevel and shuffle settings per variable (e.g. a table made by benchmarks/bench_encoding.py).
+    """
+    chunks_key = 'chunksizes' if backend == 'netcdf' else 'chunks'
+    encoding = {}
+    for name, var in dset.data_vars.items():
+        settings = {'compressor': compressor, 'complevel': complevel, 'shuffle': shuffle, **(variables or {}).get(name, {})}
+        if var.dtype.kind == 'U':
+            char_encoding = {'dtype': 'S1'} if backend == 'netcdf' else {}
+            encoding[name] = {**char_encoding, **compression_encoding(backend, itemsize=var.dtype.itemsize, **settings)}
+            continue
+        encoding[name] = {chunks_key: chunk_shape(var), **compression_encoding(backend, itemsize=var.dtype.itemsize, **settings)}
+    return encoding
+
+
+def write_dataset(dset: Dataset, path: Path, backend: str, sparse: Iterable[str] = (), **compression) -> None:
+    """
+    Writes dset as a NetCDF file or Zarr store; compression holds the other make_encoding() arguments.
+    The variables named in sparse are stored as their non-zero values only (see sparsify_variables()).
+    """
+    dset = sparsify_variables(dset, sparse)
+    encoding = make_encoding(dset, backend=backend, **compression)
+    if backend == 'netcdf':
+        dset.to_netcdf(path=path, format="NETCDF4", engine="netcdf4", encoding=encoding)
+    else:
+        dset.to_zarr(path, mode='w', encoding=encoding, zarr_format=2, consolidated=True)
+
+
+def convert_session(dd_part: dict[str, Any], dd_wav: dict[str, Any], dd_lfp: dict[str, Any], dd_st: dict[str, Any], base_path: Path, storage: dict[str, Any] = STORAGE_SETTINGS) -> tuple[Path, dict[str, Any]]:
+    """
+    Builds the xarray Dataset for one session and writes it to a compressed, chunked NetCDF file or Zarr store,
+    returning its path and its catalog entry (see summarize_session()).
+    """
+    # Verify that the sessions in different files match, using cell counts
+    if dd_wav['waveform_w'].shape[0] != dd_part['cellid_orig'].sum():
+        raise IOError(f"Problem at {dd_part['date_exp'], dd_part['mouse_name']}.  Reason: has a different number of cells in the partx.npx and extra.npx data files")
+
+    # Make xarray Dataset for most data, save to compressed file.
+    dset = steinmetz_to_xarray(dd_part=dd_part, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st)
+
+    session_path = base_path / f'steinmetz_{dd_part["date_exp"]}_{dd_part["mouse_name"]}{BACKEND_SUFFIXES[storage["backend"]]}'
+    session_path.parent.mkdir(parents=True, exist_ok=True)
+    write_dataset(dset, path=session_path, **storage)
+    return session_path, summarize_session(dset, session_path)
+
+
+def spill_sessions(archive_path: Path, spill_path: Path) -> int:
+    """Unpickles a session archive once and writes each session to its own pickle file, returning the number of sessions."""
+    dat = np.load(archive_path, allow_pickle=True)['dat']
+    for idx in range(len(dat)):
+        with open(spill_path / f'{archive_path.stem}_{idx:03d}.pkl', 'wb') as f:
+            pickle.dump(dat[idx], f, protocol=pickle.HIGHEST_PROTOCOL)
+        dat[idx] = None  # free each session as soon as it is on disk
+    return len(dat)
+
+
+def unspill_session(path: Path) -> dict[str, Any]:
+    with open(path, 'rb') as f:
+        dd = pickle.load(f)
+    path.unlink()
+    return dd
+
+
+class SessionSource(NamedTuple):
+    part_name: str  # the steinmetz_partX.npz file the session is stored in
+    index: int  # position of the session across all part files, which aligns it with the st/wav/lfp archives
+
+
+def iter_sessions(
+    raw_path: Path,
+    skip: Optional[Callable[[SessionSource], bool]] = None,
+    part_sizes: Optional[dict[str, int]] = None,
+) -> Iterator[tuple[SessionSource, dict, dict, dict, dict]]:
+    """
+    Yields aligned (source, part, st, wav, lfp) sessions one at a time.
+
+    The NPZ archives hold pickled object arrays, which can only be unpickled whole.  So the three
+    steinmetz_st/wav/lfp archives are first split into one temporary file per session; after that, only
+    one steinmetz_partX archive and the session being converted are held in memory.
+
+    Sessions for which skip(source) is True are not yielded.  If part_sizes gives the number of sessions in
+    a part file and all of them are skipped, the part file isn't read at all (and if no session is needed,
+    neither are the st/wav/lfp archives).  part_sizes is filled in for every part file that gets read.
+    """
+    skip = skip or (lambda source: False)
+    part_sizes = {} if part_sizes is None else part_sizes
+    extra_names = ['steinmetz_st', 'steinmetz_wav', 'steinmetz_lfp']
+    with TemporaryDirectory(prefix='sessions_', dir=raw_path) as spill_dir:
+        spill_path = Path(spill_dir)
+        n_sessions = {}
+
+        session_idx = 0
+        for path in [raw_path / 'neuropixels' / f'steinmetz_part{i}.npz' for i in [0, 1, 2]]:
+            if path.name in part_sizes:
+                sources = [SessionSource(path.name, idx) for idx in range(session_idx, session_idx + part_sizes[path.name])]
+                if all(skip(source) for source in sources):
+                    session_idx += len(sources)
+                    continue
+
+            if not n_sessions:
+                for name in extra_names:
+                    print(f'Splitting {name}.npz into sessions...', end='', flush=True)
+                    n_sessions[name] = spill_sessions(raw_path / 'lfp' / f'{name}.npz', spill_path=spill_path)
+                    print(f'..done.', flush=True)
+
+            dat = np.load(path, allow_pickle=True)['dat']
+            part_sizes[path.name] = len(dat)
+            for part_idx in range(len(dat)):
+                if session_idx >= min(n_sessions.values()):
+                    warn(f"{path.name} has more sessions than the {', '.join(extra_names)} files; skipping the rest.")
+                    return
+                source = SessionSource(path.name, session_idx)
+                session_idx += 1
+                if skip(source):
+                    continue
+                dd, dat[part_idx] = dat[part_idx], None
+                dd_st, dd_wav, dd_lfp = (unspill_session(spill_path / f'{name}_{source.index:03d}.pkl') for name in extra_names)
+                yield source, dd, dd_st, dd_wav, dd_lfp
+                del dd, dd_st, dd_wav, dd_lfp
+            del dat
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 23), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def path_checksum(path: Path) -> str:
+    """Returns the sha256 checksum of a file, or of the names and contents of all files in a directory (e.g. a Zarr store)."""
+    if not path.is_dir():
+        return file_checksum(path)
+    digest = hashlib.sha256()
+    for file_path in sorted(p for p in path.rglob('*') if p.is_file()):
+        digest.update(file_path.relative_to(path).as_posix().encode())
+        digest.update(file_checksum(file_path).encode())
+    return digest.hexdigest()
+
+
+def path_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file()) if path.is_dir() else path.stat().st_size
+
+
+def summarize_session(dset: Dataset, session_path: Path) -> dict[str, Any]:
+    """Returns the session's row of the catalog: what it recorded, and where its file is."""
+    return {
+        'mouse': dset.attrs['mouse'],
+        'session_date': dset.attrs['session_date'],
+        'n_cells': dset.sizes['cell'],
+        'n_trials': dset.sizes['trial'],
+        'n_active_trials': int(dset['active_trials'].values.sum()),
+        'brain_areas': dset['brain_area_categories'].values.tolist(),  # Every category is used by some cell
+        'brain_groups': dset['brain_groups_categories'].values.tolist(),
+        'path': session_path.name,
+        'size': path_size(session_path),
+        'sha256': path_checksum(session_path),
+    }
+
+
+class Manifest:
+    """
+    Records, for each written session file, the checksums of the NPZ files it was made from, the converter
+    version and the encoding settings, so that sessions whose inputs and settings haven't changed can be skipped.
+    Each entry also holds the session's summary, from which write_catalog() builds the session catalog.
+    """
+
+    def __init__(self, path: Path, raw_path: Path, storage: dict[str, Any] = STORAGE_SETTINGS) -> None:
+        self.path = path
+        self.storage = storage
+        self.data = json.loads(path.read_text()) if path.exists() else {'parts': {}, 'sessions': {}}
+        self.checksums = {
+            path.name: file_checksum(path)
+            for path in sorted(raw_path.glob('neuropixels/steinmetz_part*.npz')) + sorted(raw_path.glob('lfp/steinmetz_*.npz'))
+        }
+        self.part_sizes = {
+            name: part['n_sessions'] for name, part in self.data['parts'].items()
+            if part['sha256'] == self.checksums.get(name)
+        }
+
+    def _entry(self, source: SessionSource) -> dict[str, Any]:
+        return {
+            'session_index': source.index,
+            'sources': {name: self.checksums.get(name) for name in [source.part_name, 'steinmetz_st.npz', 'steinmetz_wav.npz', 'steinmetz_lfp.npz']},
+            'converter_version': CONVERTER_VERSION,
+            'encoding': self.storage,
+        }
+
+    def is_up_to_date(self, source: SessionSource) -> bool:
+        expected = self._entry(source)
+        for filename, entry in self.data['sessions'].items():
+            if entry['session_index'] == source.index:
+                # Entries written before the catalog existed have no summary, so their sessions are converted again
+                settings = {key: value for key, value in entry.items() if key != 'summary'}
+                return 'summary' in entry and settings == expected and (self.path.parent / filename).exists()
+        return False
+
+    def record(self, source: SessionSource, session_path: Path, summary: dict[str, Any]) -> None:
+        sessions = {name: entry for name, entry in self.data['sessions'].items() if entry['session_index'] != source.index}
+        sessions[session_path.name] = {**self._entry(source), 'summary': summary}
+        self.data['sessions'] = sessions
+        self.data['parts'] = {name: {'sha256': self.checksums[name], 'n_sessions': n} for name, n in self.part_sizes.items()}
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.data, indent=2))
+        tmp_path.replace(self.path)
+
+    def write_catalog(self, path: Path) -> pd.DataFrame:
+        """
+        Writes the summaries of all recorded sessions whose files exist to a Parquet file, one row per session, so that
+        sessions can be found without opening their files (see session_reader.read_catalog()).
+        """
+        rows = [
+            entry['summary'] for filename, entry in sorted(self.data['sessions'].items(), key=lambda item: item[1]['session_index'])
+            if 'summary' in entry and (self.path.parent / filename).exists()
+        ]
+        catalog = pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+        tmp_path = path.with_name(path.name + '.tmp')
+        catalog.to_parquet(tmp_path, index=False)
+        tmp_path.replace(path)
+        return catalog
+
+
+def peak_memory_mb() -> Optional[tuple[float, float]]:
+    """Returns the peak resident memory (in MB) of this process and of its largest worker process, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    scale = 1 / 1024 ** 2 if sys.platform == 'darwin' else 1 / 1024  # ru_maxrss is in bytes on macOS, in KB on Linux
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    )
+
+
+def convert_sessions(
+    sessions: Iterable[tuple[SessionSource, dict, dict, dict, dict]],
+    base_path: Path,
+    workers: int = 1,
+    storage: dict[str, Any] = STORAGE_SETTINGS,
+    on_written: Optional[Callable[[SessionSource, Path, dict[str, Any]], None]] = None,
+) -> list[str]:
+    """
+    Converts each (source, dd_part, dd_st, dd_wav, dd_lfp) session, using a process pool when workers > 1,
+    and calls on_written(source, session_path, summary) for every file written.
+    A failing session doesn't stop the others; the error messages of all failed sessions are returned.
+    """
+    on_written = on_written or (lambda source, session_path, summary: None)
+    errors = []
+    progress = tqdm(desc="Writing Processed NetCDF Files", unit='session')
+
+    def record_error(dd_part: dict[str, Any], error: Exception) -> None:
+        message = f"{dd_part['date_exp']}_{dd_part['mouse_name']}: {error!r}"
+        errors.append(message)
+        progress.write(f"Failed: {message}")
+
+    if workers == 1:
+        for source, dd, dd_st, dd_wav, dd_lfp in sessions:
+            try:
+                session_path, summary = convert_session(dd_part=dd, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st, base_path=base_path, storage=storage)
+                on_written(source, session_path, summary)
+            except Exception as error:
+                record_error(dd, error)
+            progress.update()
+            del dd, dd_st, dd_wav, dd_lfp
+    else:
+        def collect(futures: dict, return_when: str) -> None:
+            done, _ = wait(futures, return_when=return_when)
+            for future in done:
+                source, dd = futures.pop(future)
+                try:
+                    on_written(source, *future.result())
+                except Exception as error:
+                    record_error(dd, error)
+                progress.update()
+
+        # Keep only a few sessions in flight, so memory stays bounded no matter how many sessions there are
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for source, dd, dd_st, dd_wav, dd_lfp in sessions:
+                if len(futures) >= 2 * workers:
+                    collect(futures, return_when=FIRST_COMPLETED)
+                future = pool.submit(convert_session, dd_part=dd, dd_wav=dd_wav, dd_lfp=dd_lfp, dd_st=dd_st, base_path=base_path, storage=storage)
+                futures[future] = source, {'date_exp': dd['date_exp'], 'mouse_name': dd['mouse_name']}
+                del dd, dd_st, dd_wav, dd_lfp
+            collect(futures, return_when=ALL_COMPLETED)
+
+    progress.close()
+    return errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert the raw Steinmetz NPZ files into one compressed NetCDF file (or Zarr store) per session.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of sessions to convert in parallel processes (default: 1)')
+    parser.add_argument('--force', action='store_true', help='Convert all sessions, even those whose NetCDF file is already up to date')
+    parser.add_argument('--backend', choices=list(BACKEND_SUFFIXES), default=STORAGE_SETTINGS['backend'], help='File format to write (default: %(default)s)')
+    parser.add_argument('--compressor', choices=COMPRESSORS, default=STORAGE_SETTINGS['compressor'], help='Compression codec; blosc and lz4 are only available for zarr (default: %(default)s)')
+    parser.add_argument('--complevel', type=int, default=STORAGE_SETTINGS['complevel'], help='Compression level (default: %(default)s)')
+    parser.add_argument('--encoding-table', type=Path, help='JSON file of per-variable compression settings, as written by benchmarks/bench_encoding.py')
+    parser.add_argument('--sparse', nargs='+', default=[], metavar='VARIABLE', help='Variables (e.g. spike_rate) to store as their non-zero values only; read them with spikes.read_sparse()')
+    args = parser.parse_args()
+    storage = {'backend': args.backend, 'compressor': args.compressor, 'complevel': args.complevel, 'shuffle': STORAGE_SETTINGS['shuffle']}
+    if args.encoding_table:
+        storage['variables'] = json.loads(args.encoding_table.read_text())
+    if args.sparse:
+        storage['sparse'] = args.sparse
+    try:
+        defaults = {'compressor': args.compressor, 'complevel': args.complevel, 'shuffle': storage['shuffle']}
+        for settings in [{}, *storage.get('variables', {}).values()]:
+            compression_encoding(args.backend, **{**defaults, **settings})
+    except (ValueError, TypeError, ImportError) as error:
+        parser.error(str(error))
+
+    raw_path = Path('data/raw')
+    base_path = Path('data/processed')
+    base_path.mkdir(parents=True, exist_ok=True)
+
+    print('Checking Raw NPZ Files...', end='', flush=True)
+    manifest = Manifest(path=base_path / 'manifest.json', raw_path=raw_path, storage=storage)
+    print(f'..done.', flush=True)
+
+    sessions = iter_sessions(
+        raw_path=raw_path,
+        skip=None if args.force else manifest.is_up_to_date,
+        part_sizes=manifest.part_sizes,
+    )
+    errors = convert_sessions(sessions, base_path=base_path, workers=args.workers, storage=storage, on_written=manifest.record)
+    catalog = manifest.write_catalog(base_path / 'catalog.parquet')
+    print(f'Catalog of {len(catalog)} sessions written to {base_path / "catalog.parquet"}', flush=True)
+
+    peak_memory = peak_memory_mb()
+    if peak_memory:
+        workers_info = f', {peak_memory[1]:.0f} MB (largest worker process)' if args.workers > 1 else ''
+        print(f'Peak memory: {peak_memory[0]:.0f} MB (main process){workers_info}', flush=True)
+
+    if errors:
+        raise IOError(f"{len(errors)} session(s) could not be converted:\n" + "\n".join(errors))
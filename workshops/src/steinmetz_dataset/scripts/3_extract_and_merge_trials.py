@@ -2,64 +2,54 @@
 # !pip install netCDF4 pyarrow
 
 # %%
-from glob import glob
-from hashlib import md5
+from session_reader import assign_cohorts, find_sessions, read_cell_table, read_trial_table, write_group_csvs, write_partitioned_parquet
 
-import pandas as pd
-import xarray as xr
+# %%
+paths = find_sessions('../../data/*.nc')
 
 # %%
-paths = glob('../../data/*.nc')
+# Sessions are grouped into cohorts by date; edit this mapping to change which sessions end up in which output.
+COHORTS = {
+    'winter2016': [
+        '2016-12-14', '2016-12-17', '2016-12-18',
+        '2017-01-07', '2017-01-08', '2017-01-09', '2017-01-10', '2017-01-11', '2017-01-12',
+    ],
+    'summer2017': [
+        '2017-05-15', '2017-05-16', '2017-05-18',
+        '2017-06-15', '2017-06-16', '2017-06-17', '2017-06-18',
+    ],
+    'winter2017': [
+        '2017-10-11', '2017-10-29', '2017-10-30', '2017-10-31',
+        '2017-11-01', '2017-11-02', '2017-11-04', '2017-11-05',
+        '2017-12-05', '2017-12-06', '2017-12-07', '2017-12-08', '2017-12-09', '2017-12-10', '2017-12-11',
+    ],
+}
+WRITE_CSV = True  # The CSV files are only needed by the notebooks that read them; the Parquet dataset has everything.
 
 # %%
-dfs = []
-for path in paths:
-    dset = xr.load_dataset(path)
-    df = dset[['active_trials', 'contrast_left', 'contrast_right', 'stim_onset', 'gocue', 'response_type', 'response_time', 'feedback_time', 'feedback_type', 'reaction_time', 'reaction_type']].to_dataframe().reset_index()
-    # df = df[df['active_trials']].drop(columns=['active_trials'])
-    df = df.rename(columns={'gocue': 'gocue_time'})
-    df = df.assign(
-        mouse=dset.attrs['mouse'], 
-        session_date=dset.attrs['session_date'], 
-        session_id=str(md5((dset.attrs['mouse'] + dset.attrs['session_date']).encode()).hexdigest())[:6],
-    )
-    dfs.append(df)
-df = pd.concat(dfs, ignore_index=True)
+df = read_trial_table(paths, workers=8)
 df.head()
 
 
 # %%
-df_winter2016 = df[df.session_date.isin(
-    ['2016-12-14', '2016-12-17', '2016-12-18', 
-     '2017-01-07', '2017-01-08', '2017-01-09', '2017-01-10', '2017-01-11', '2017-01-12',
-    ]
-)]
-df_winter2016.to_csv('steinmetz_winter2016.csv', index=False)
-
-# %%
-df_summer2017 = df[df.session_date.isin(
-    ['2017-05-15', '2017-05-16', '2017-05-18',
-    '2017-06-15', '2017-06-16', '2017-06-17', '2017-06-18',]
-)]
-df_summer2017.to_csv('steinmetz_summer2017.csv', index=False)
-# df_summer2017.head()
+cohorts = assign_cohorts(df['session_date'], COHORTS)
+write_partitioned_parquet(df.assign(cohort=cohorts), 'steinmetz_trials')
+df.to_parquet('steinmetz_day1.parquet')
 
 # %%
-df_winter2017 = df[df.session_date.isin(
-    ['2017-10-11', '2017-10-29', '2017-10-30', '2017-10-31',
-     '2017-11-01', '2017-11-02', '2017-11-04', '2017-11-05',
-     '2017-12-05', '2017-12-06', '2017-12-07', '2017-12-08',   '2017-12-09', '2017-12-10', '2017-12-11'
-    ]
-)]
-df_winter2017.to_csv('steinmetz_winter2017.csv', index=False)
+if WRITE_CSV:
+    write_group_csvs(df, by=cohorts, path_template='steinmetz_{}.csv', groups=COHORTS)
+    df.to_csv('steinmetz_day1.csv')
+    df.to_csv('steinmetz_day1_compressed.csv', compression="gzip")
 
 # %%
-df.to_parquet('steinmetz_day1.parquet')
-df.to_csv('steinmetz_day1.csv')
-df.to_csv('steinmetz_day1_compressed.csv', compression="gzip")
+df.session_date.unique()
 
 # %%
-df.session_date.unique()
+# One row per recorded cell; brain_area and brain_groups are categorical, so filtering and grouping by region are fast.
+cells = read_cell_table(paths, workers=8)
+cells.to_parquet('steinmetz_cells.parquet', index=False)
+cells.groupby('brain_groups', observed=True).size()
 
 # %%
 
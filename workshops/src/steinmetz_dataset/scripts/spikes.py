@@ -0,0 +1,183 @@
+"""Queries the spikes of a processed Steinmetz session: raw spike events through the spike_offset index written by the converter, and sparse spike counts."""
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+import xarray as xr
+
+from session_reader import hdf5_lock
+
+SPIKE_VARIABLES = ['spike_time', 'spike_cell', 'spike_trial', 'spike_offset']
+ALIGN_EVENTS = ['gocue', 'response_time', 'feedback_time']  # Per-trial event times (from trial start) that spikes can be aligned to
+
+
+def _widen(values: np.ndarray) -> np.ndarray:
+    """Casts small integers to int32 for sparse arrays, whose reductions fail when the sum of the fill values overflows the dtype (e.g. int8 over 128 bins)."""
+    return values.astype(np.promote_types(values.dtype, np.int32)) if values.dtype.kind in 'iu' else values
+
+
+def _sparse_coords(flat_index: np.ndarray, shape: tuple[int, ...]) -> np.ndarray:
+    """Returns the coordinates of C-order flat indices into shape, in the smallest signed integer type that holds them (instead of 8 bytes each)."""
+    dtype = next(dtype for dtype in [np.int16, np.int32, np.int64] if max(shape) <= np.iinfo(dtype).max)
+    coords = np.empty((len(shape), len(flat_index)), dtype=dtype)
+    for axis, positions in enumerate(np.unravel_index(flat_index, shape)):
+        coords[axis] = positions
+    return coords
+
+
+def read_sparse(dset: xr.Dataset, name: str = 'spike_rate') -> xr.DataArray:
+    """
+    Returns a variable as a DataArray backed by a pydata/sparse COO array (`pip install sparse`), rebuilt from the
+    <name>_index and <name>_value variables written by `2_convert_to_netcdf.py --sparse` (or converted, if it was
+    stored densely).  Reductions and selections keep it sparse, e.g. for spike_rate:
+
+        rate = read_sparse(dset)
+        rate.sum('time')                                          # spike counts per cell and trial
+        rate.mean('trial')                                        # mean over trials
+        rate.isel(cell=(dset['brain_area'] == 'VISp').values)     # one brain area
+    """
+    import sparse  # Only needed for sparse variables
+
+    if name in dset:
+        var = dset[name]
+        values = var.values.reshape(-1)
+        index = np.flatnonzero(values)
+        data = sparse.COO(_sparse_coords(index, var.shape), _widen(values[index]), shape=var.shape, sorted=True, has_duplicates=False)
+        return var.copy(data=data)
+    index, value = dset[f'{name}_index'], dset[f'{name}_value']
+    dims = index.attrs['sparse_dims'].split()
+    shape = tuple(dset.sizes[dim] for dim in dims)
+    data = sparse.COO(_sparse_coords(index.values, shape), _widen(value.values), shape=shape, sorted=True, has_duplicates=False)
+    return xr.DataArray(data, dims=dims, coords={dim: dset.coords[dim] for dim in dims if dim in dset.coords}, name=name, attrs=value.attrs)
+
+
+class Spikes(NamedTuple):
+    time: np.ndarray
+    cell: np.ndarray
+    trial: np.ndarray
+
+
+class SpikeIndex:
+    """
+    The spike events of one session, sorted by cell, then trial, with the offset of every (cell, trial) block.
+    Looking up a cell returns views into the spike arrays, and looking up a trial gathers one block per cell,
+    so queries take time in proportion to their result instead of scanning all spikes:
+
+        index = SpikeIndex.from_file('data/processed/steinmetz_2017-01-08_Cori.nc')
+        index.cell(11).time       # all spikes of cell 11, instead of df[df['spike_cell'] == 11]
+        index.trial(24).cell      # the cell of every spike in trial 24
+        index.cells_in_trial(24)  # the cells that fired in trial 24
+        index.bin_counts(0.05, align='gocue', window=(-0.5, 1.))  # spike counts in 50 ms bins around the go cue
+    """
+
+    def __init__(self, dset: xr.Dataset) -> None:
+        if 'spike_offset' not in dset:
+            raise KeyError("The session has no spike_offset variable; it was written by an older converter, so convert it again.")
+        self.spikes = Spikes(dset['spike_time'].values, dset['spike_cell'].values, dset['spike_trial'].values)
+        self.cells = dset.indexes['cell']
+        self.trials = dset.indexes['trial']
+        offsets = dset['spike_offset'].transpose('cell', 'trial').values.astype(np.intp)
+        self.offsets = np.append(offsets.ravel(), len(self.spikes.time))  # CSR-style: block i is offsets[i]:offsets[i + 1]
+        self.events = {name: dset[name].values for name in ALIGN_EVENTS if name in dset}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'SpikeIndex':
+        """Reads only the spike variables (and coordinates) of a session file."""
+        with hdf5_lock(), xr.open_dataset(path) as dset:
+            return cls(dset[[name for name in [*SPIKE_VARIABLES, *ALIGN_EVENTS] if name in dset]].load())
+
+    def _block(self, cell_pos: int, trial_pos: int) -> int:
+        return cell_pos * len(self.trials) + trial_pos
+
+    def _take(self, start: int, stop: int) -> Spikes:
+        return Spikes(*(values[start:stop] for values in self.spikes))
+
+    def cell(self, cell: int) -> Spikes:
+        """Returns the spikes of one cell across all trials, as views into the spike arrays."""
+        cell_pos = self.cells.get_loc(cell)
+        return self._take(self.offsets[self._block(cell_pos, 0)], self.offsets[self._block(cell_pos + 1, 0)])
+
+    def cell_trial(self, cell: int, trial: int) -> Spikes:
+        """Returns the spikes of one cell in one trial, as views into the spike arrays."""
+        block = self._block(self.cells.get_loc(cell), self.trials.get_loc(trial))
+        return self._take(self.offsets[block], self.offsets[block + 1])
+
+    def _trial_blocks(self, trial: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the start and length of every cell's block of spikes in trial."""
+        blocks = np.arange(len(self.cells)) * len(self.trials) + self.trials.get_loc(trial)
+        starts = self.offsets[blocks]
+        return starts, self.offsets[blocks + 1] - starts
+
+    def trial(self, trial: int) -> Spikes:
+        """Returns the spikes of all cells in one trial, sorted by cell.  They are spread over one block per cell, so these are copies."""
+        starts, lengths = self._trial_blocks(trial)
+        # The k-th spike of each block sits at its block's start + k
+        out_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) + np.repeat(starts - out_starts, lengths)
+        return Spikes(*(values[positions] for values in self.spikes))
+
+    def counts(self) -> np.ndarray:
+        """Returns the (cell, trial) array of spike counts."""
+        return np.diff(self.offsets).reshape(len(self.cells), len(self.trials))
+
+    def cells_in_trial(self, trial: int) -> np.ndarray:
+        """Returns the cells with at least one spike in trial."""
+        return self.cells.values[self._trial_blocks(trial)[1] > 0]
+
+    def bin_counts(
+        self,
+        bin_size: float,
+        align: Union[str, np.ndarray, None] = None,
+        window: Optional[tuple[float, float]] = None,
+        as_sparse: Optional[bool] = None,
+    ) -> xr.DataArray:
+        """
+        Counts the spikes of every cell and trial in bins of bin_size seconds, returning a (cell, trial, time) DataArray
+        whose time coordinate holds the start of each bin.  Spike times are taken from trial start, or relative to align:
+        the name of a per-trial event (see ALIGN_EVENTS) or an array of one time per trial; trials whose event time
+        is NaN (e.g. passive trials) get no spikes.  window gives the (start, stop) time of the bins, and defaults to
+        the range of all spikes.
+
+        The spikes are already sorted by cell and trial, so the counts come from one pass of run-lengths over the bin
+        number of each spike, without a dense histogram.  With as_sparse (which defaults to whether that takes less
+        memory than a dense array), the counts are a pydata/sparse COO array (`pip install sparse`).
+        """
+        n_cells, n_trials = len(self.cells), len(self.trials)
+        blocks = np.repeat(np.arange(n_cells * n_trials), np.diff(self.offsets))
+        times = self.spikes.time.astype(np.float64)
+        if align is not None:
+            event_times = self.events[align] if isinstance(align, str) else np.asarray(align, dtype=np.float64)
+            times -= event_times[blocks % n_trials]
+
+        if window is None:
+            finite = times[np.isfinite(times)]
+            window = (np.floor(finite.min() / bin_size) * bin_size, (np.floor(finite.max() / bin_size) + 1) * bin_size) if finite.size else (0., bin_size)
+        n_bins = int(round((window[1] - window[0]) / bin_size))
+        bins = np.floor((times - window[0]) / bin_size)
+        inside = (bins >= 0) & (bins < n_bins)  # Also drops NaNs
+        keys = blocks[inside] * n_bins + bins[inside].astype(np.intp)
+        shape = (n_cells, n_trials, n_bins)
+
+        if len(keys) and np.any(keys[1:] < keys[:-1]):  # Spike times out of order within a trial
+            keys = np.sort(keys)
+        run_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=np.intp)
+        flat = keys[run_starts]
+        counts = np.diff(np.r_[run_starts, len(keys)])
+        counts = counts.astype(np.min_scalar_type(counts.max() if len(counts) else 0))
+
+        if as_sparse is None:  # A COO array holds 3 coordinates and a (widened) count per non-zero bin
+            sparse_itemsize = 3 * _sparse_coords(flat[:0], shape).itemsize + np.promote_types(counts.dtype, np.int32).itemsize
+            as_sparse = len(flat) * sparse_itemsize < np.prod(shape) * counts.itemsize
+        if as_sparse:
+            import sparse  # Only needed for sparse output
+            data = sparse.COO(_sparse_coords(flat, shape), _widen(counts), shape=shape, sorted=True, has_duplicates=False)
+        else:
+            data = np.zeros(np.prod(shape), dtype=counts.dtype)
+            data[flat] = counts
+            data = data.reshape(shape)
+
+        return xr.DataArray(
+            data=data,
+            dims=('cell', 'trial', 'time'),
+            coords={'cell': self.cells, 'trial': self.trials, 'time': window[0] + np.arange(n_bins) * bin_size},
+            attrs={'bin_size': bin_size, 'align': align if isinstance(align, str) else ('trial start' if align is None else 'custom')},
+        )
\ No newline at end of file